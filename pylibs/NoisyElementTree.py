@@ -12,18 +12,166 @@ be pretty formated.
 Incompatible with ET version <= 1.2.6. Use at least version 1.3.0
 """
 
+import io
+import json
+import mmap
+import os
 import re
+import time
+from bisect import bisect_left
+from collections import OrderedDict
 import xml.etree.ElementTree as ET
-from   xml.etree.ElementTree import _namespaces, _encode, _serialize
+from   xml.etree.ElementTree import _namespaces, _serialize
+try:
+    from xml.etree.ElementTree import _encode
+except ImportError:
+    # Python 3
+    _encode = None
+
+_NS_RE = re.compile(r"\{(.*)\}")
+
+def _split_tag(tag):
+    "Return (namespace, local name) of the tag."
+    pos = tag.rfind('}')
+    if pos == -1 or tag[:1] != '{':
+        return "", tag
+    return tag[1:pos], tag[pos+1:]
+
+
+class NSIndex(object):
+    """
+    Index of elements of the tree by local names and namespaces.
+
+    Elements are kept in the document order together with their position
+    in the tree, so elements of any subtree are found by bisection. Create
+    it by NSElement.build_ns_index(); queries of NSElement use it then.
+    The index is rebuilt on the next query after a mutation by NSElement
+    methods (append(), remove(), ...) or by SubElement() of this module.
+    Attention: ET.SubElement() of Python 3 is implemented in C and bypasses
+    these methods; only children added by it to the queried element itself
+    are noticed. Call invalidate() after such changes deeper in the tree,
+    when tags are changed directly or the tree is modified by other ways.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._build()
+
+    def invalidate(self):
+        self.dirty = True
+
+    def _add(self, elem, pos):
+        if isinstance(elem, NSElement):
+            elem._ns_index = self
+        if not isinstance(elem.tag, str):
+            return
+        ns, local = _split_tag(elem.tag)
+        for table, key in ((self.by_local, local),
+                           (self.by_qname, (ns, local)),
+                           (self.by_ns, ns)):
+            entry = table.get(key, None)
+            if entry is None:
+                entry = table[key] = ([], [])
+            entry[0].append(pos)
+            entry[1].append(elem)
+
+    def _build(self):
+        # key -> (list of positions, list of elements)
+        self.by_local = {}
+        self.by_qname = {}
+        self.by_ns = {}
+        # id(element) -> (position, position behind its subtree, number
+        # of children)
+        self._pos = {}
+        # (element, iterator of its children, position) - preorder walk
+        self._add(self.root, 0)
+        stack = [(self.root, iter(self.root), 0)]
+        pos = 1
+        while stack:
+            elem, children, start = stack[-1]
+            for child in children:
+                self._add(child, pos)
+                stack.append((child, iter(child), pos))
+                pos += 1
+                break
+            else:
+                stack.pop()
+                self._pos[id(elem)] = (start, pos, len(elem))
+        self.dirty = False
+
+    def _changed(self, elem):
+        "Return True when children of the elem were added or removed."
+        pos = self._pos.get(id(elem), None)
+        return pos is not None and len(elem) != pos[2]
+
+    def _find(self, table, key, elem):
+        "Return list of elements of the table entry inside the elem subtree."
+        pos = self._pos.get(id(elem), None)
+        if pos is None:
+            return None
+        entry = table.get(key, None)
+        if entry is None:
+            return []
+        lo = bisect_left(entry[0], pos[0])
+        hi = bisect_left(entry[0], pos[1], lo)
+        return entry[1][lo:hi]
+
+    def find_ignore_ns(self, elem, tag):
+        """
+        Return list of elements with the local name inside the elem subtree
+        or None when the elem is not in the index.
+        """
+        if self.dirty or self._changed(elem):
+            self._build()
+        return self._find(self.by_local, tag, elem)
+
+    def find_same_ns(self, elem, tag=None):
+        """
+        Return list of elements of the elem namespace (with the local name
+        when set) inside the elem subtree or None when the elem is not
+        in the index.
+        """
+        if not isinstance(elem.tag, str):
+            return None
+        if self.dirty or self._changed(elem):
+            self._build()
+        ns = _split_tag(elem.tag)[0]
+        if tag is None:
+            return self._find(self.by_ns, ns, elem)
+        return self._find(self.by_qname, (ns, tag), elem)
+
 
 class NSElement(ET.Element):
+    # NSIndex of the tree, see build_ns_index()
+    _ns_index = None
+
     def __init__(self, tag, attrib={}, **extra):
-        ET.Element.__init__(self, tag, attrib)
+        ET.Element.__init__(self, tag, attrib, **extra)
 
     def namespace(self, keep_brackets=False):
         "Extract namespace from tag"
-        m = re.match("\{.*\}", self.tag)
-        return ("{"+m.group(0)+"}" if keep_brackets else m.group(0)) if m else ""
+        m = _NS_RE.match(self.tag) if isinstance(self.tag, str) else None
+        if not m:
+            return ""
+        return m.group(0) if keep_brackets else m.group(1)
+
+    def makeelement(self, tag, attrib):
+        # new elements of the tree are NSElements too
+        return self.__class__(tag, attrib)
+
+    def build_ns_index(self):
+        """
+        Build NSIndex of the subtree and return it.
+
+        Use it when many queries by iter_ignore_ns() or iter_same_ns() are
+        done on the tree; they are answered by the index then instead
+        of walking the subtree.
+        """
+        return NSIndex(self)
+
+    def _invalidate_ns_index(self):
+        if self._ns_index is not None:
+            self._ns_index.invalidate()
 
     def iter_ignore_ns(self, tag=None):
         """
@@ -38,7 +186,15 @@ class NSElement(ET.Element):
         so you can get all elements with same taf across various namespaces.
         """
         if tag is None:
-            yield self.iter()
+            for elem in self.iter():
+                yield elem
+            return
+        index = self._ns_index
+        found = index.find_ignore_ns(self, tag) if index else None
+        if found is not None:
+            for elem in found:
+                yield elem
+            return
         for elem in self.iter():
             if not isinstance(elem.tag, str):
                 continue
@@ -62,37 +218,317 @@ class NSElement(ET.Element):
              for i in element.iter_same_ns("pepa"):
                  # returns only element1
         """
-        ns = self.namespace(True)
+        index = self._ns_index
+        found = index.find_same_ns(self, tag) if index else None
+        if found is not None:
+            for elem in found:
+                yield elem
+            return
+        ns = _split_tag(self.tag)[0] if isinstance(self.tag, str) else ""
         for elem in self.iter():
             if not isinstance(elem.tag, str):
                 continue
-            if (tag is None) and elem.tag.startswith(ns):
-                yield elem
-            elif (tag is not None) and (elem.tag == ns+tag):
+            elem_ns, local = _split_tag(elem.tag)
+            if elem_ns == ns and (tag is None or local == tag):
                 yield elem
 
+    def find_ns(self, path):
+        "Return the first element matching the path (see NSQuery) or None."
+        return compile_query(path).find(self)
 
-class CommentTreeBuilder(ET.XMLTreeBuilder):
-    "XMLTreeBuilder which keeps XML comments, includes comments outside root"
+    def findall_ns(self, path):
+        "Return list of elements matching the path (see NSQuery)."
+        return compile_query(path).findall(self)
+
+    def iterfind_ns(self, path):
+        "Yield elements matching the path (see NSQuery)."
+        return compile_query(path).iterfind(self)
+
+    # mutators invalidate the index of the tree
+
+    def append(self, element):
+        self._invalidate_ns_index()
+        ET.Element.append(self, element)
+
+    def extend(self, elements):
+        self._invalidate_ns_index()
+        ET.Element.extend(self, elements)
+
+    def insert(self, index, element):
+        self._invalidate_ns_index()
+        ET.Element.insert(self, index, element)
+
+    def remove(self, element):
+        self._invalidate_ns_index()
+        ET.Element.remove(self, element)
+
+    def clear(self):
+        self._invalidate_ns_index()
+        ET.Element.clear(self)
+
+    def __setitem__(self, index, element):
+        self._invalidate_ns_index()
+        ET.Element.__setitem__(self, index, element)
+
+    def __delitem__(self, index):
+        self._invalidate_ns_index()
+        ET.Element.__delitem__(self, index)
+
+
+def SubElement(parent, tag, attrib={}, **extra):
+    """
+    Like ET.SubElement() but the element is added by parent.append().
+
+    ET.SubElement() of Python 3 is implemented in C and bypasses methods
+    of NSElement, so it cannot invalidate NSIndex of the tree.
+    """
+    attrib = dict(attrib, **extra)
+    element = parent.makeelement(tag, attrib)
+    parent.append(element)
+    return element
+
+
+### namespace-agnostic path queries ###
+
+# one step of the path: separator, name and predicates
+_STEP_RE = re.compile(
+    r"(//|/|)(\{[^}]*\}[^/\[\]{}]*|[^/\[\]{}]+)((?:\[[^\]]*\])*)")
+_PREDICATE_RE = re.compile(
+    r"""\[\s*(?:@([^\s=\]]+)\s*(?:=\s*(?:'([^']*)'|"([^"]*)"))?|(\d+))\s*\]""")
+
+
+class NSQuery(object):
+    """
+    Compiled path query which matches tags by local names.
+
+    Path consists of steps separated by "/" (children) or "//" (all
+    descendants). Step is:
+        name            - element with the local name in any namespace
+        {ns}name        - element with the local name in the namespace
+        {}name          - element with the local name without namespace
+        *, {ns}*        - any element (in the namespace)
+        .               - the element itself
+    followed by any number of predicates:
+        [@attr]         - the element has the attribute (any namespace)
+        [@attr='value'] - the attribute has the value
+        [n]             - n-th matching element (from 1) of the parent
+    E.g. "keyboard/keybind[@key='W-e']//action"
+
+    Use compile_query() to get cached queries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # list of (descendant, ns, local, predicates); ns/local is None
+        # for "any"; step "." has descendant None
+        self.steps = []
+        pos = 0
+        while pos < len(path):
+            m = _STEP_RE.match(path, pos)
+            if not m or (pos == 0 and m.group(1) == "/") or (
+                    pos > 0 and not m.group(1)):
+                raise SyntaxError("invalid path: %r" % path)
+            sep, name, preds = m.groups()
+            self.steps.append(self._step(sep, name, preds, path))
+            pos = m.end()
+        if not self.steps:
+            raise SyntaxError("empty path")
+
+    @staticmethod
+    def _step(sep, name, preds, path):
+        descendant = sep == "//"
+        if name == ".":
+            descendant = None
+            ns = local = None
+        elif name.startswith("{"):
+            ns, local = name[1:].split("}", 1)
+            local = None if local == "*" else local
+        else:
+            ns = None
+            local = None if name == "*" else name
+        if local == "":
+            raise SyntaxError("invalid path: %r" % path)
+        predicates = []
+        for pred in re.findall(r"\[[^\]]*\]", preds):
+            m = _PREDICATE_RE.match(pred)
+            if not m:
+                raise SyntaxError("invalid predicate %s in %r" % (pred, path))
+            attr, val1, val2, num = m.groups()
+            if num is not None:
+                predicates.append(("pos", int(num)))
+            else:
+                predicates.append(("attr", attr,
+                                   val1 if val1 is not None else val2))
+        return descendant, ns, local, predicates
+
+    @staticmethod
+    def _match(elem, ns, local):
+        if not isinstance(elem.tag, str):
+            return False
+        if ns is None and local is None:
+            return True
+        elem_ns, elem_local = _split_tag(elem.tag)
+        return ((ns is None or ns == elem_ns)
+                and (local is None or local == elem_local))
+
+    @staticmethod
+    def _has_attr(elem, name, value):
+        for key, val in elem.attrib.items():
+            if key == name or _split_tag(key)[1] == name:
+                if value is None or val == value:
+                    return True
+        return False
+
+    def _candidates(self, ctx, descendant, ns, local):
+        "Yield elements of the step for the context element."
+        if descendant is None:
+            yield ctx
+        elif not descendant:
+            for child in ctx:
+                if self._match(child, ns, local):
+                    yield child
+        else:
+            index = getattr(ctx, "_ns_index", None)
+            found = None
+            if index is not None and local is not None:
+                found = index.find_ignore_ns(ctx, local)
+            if found is None:
+                found = ctx.iter()
+            for elem in found:
+                if elem is not ctx and self._match(elem, ns, local):
+                    yield elem
+
+    @staticmethod
+    def _nth(matched, n, parents):
+        """
+        Return n-th element of every parent from the matched elements.
+
+        The parents map id of the element to id of its parent; when it is
+        None, all elements have the same parent.
+        """
+        if parents is None:
+            return list(matched)[n-1:n]
+        counts = {}
+        result = []
+        for elem in matched:
+            parent = parents[id(elem)]
+            count = counts.get(parent, 0) + 1
+            counts[parent] = count
+            if count == n:
+                result.append(elem)
+        return result
+
+    def iterfind(self, elem):
+        "Yield matching elements in the document order."
+        contexts = [elem]
+        for descendant, ns, local, predicates in self.steps:
+            result = []
+            seen = set()
+            for ctx in contexts:
+                matched = self._candidates(ctx, descendant, ns, local)
+                # descendants have various parents, [n] counts per parent
+                parents = None
+                for pred in predicates:
+                    if pred[0] == "attr":
+                        matched = [e for e in matched
+                                   if self._has_attr(e, pred[1], pred[2])]
+                        continue
+                    if descendant and parents is None:
+                        parents = dict((id(child), id(parent))
+                                       for parent in ctx.iter()
+                                       for child in parent)
+                    matched = self._nth(matched, pred[1], parents)
+                for found in matched:
+                    if id(found) not in seen:
+                        seen.add(id(found))
+                        result.append(found)
+            contexts = result
+            if not contexts:
+                break
+        return iter(contexts)
+
+    def findall(self, elem):
+        return list(self.iterfind(elem))
+
+    def find(self, elem):
+        for found in self.iterfind(elem):
+            return found
+        return None
+
+
+# path -> NSQuery; ordered from the least recently used
+_query_cache = OrderedDict()
+QUERY_CACHE_SIZE = 256
+
+def compile_query(path):
+    """
+    Return compiled NSQuery of the path.
+
+    Compiled queries are kept in a LRU cache (QUERY_CACHE_SIZE items),
+    so the same paths used for many documents are parsed just once.
+    """
+    query = _query_cache.pop(path, None)
+    if query is None:
+        query = NSQuery(path)
+        while len(_query_cache) >= QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    _query_cache[path] = query
+    return query
 
-    def __init__(self, html=0, target=None):
-        ET.XMLTreeBuilder.__init__(self, html, target)
-        self._parser.CommentHandler = self.handle_comment
-        # this will contain all comments in XML - see NoisyElementTree.parse()
-        self._commentElemList = []
 
-    def handle_comment(self, data):
-        self._target.start(ET.Comment, {})
-        self._target.data(data)
-        self._commentElemList.append(self._target.end(ET.Comment))
+# TreeBuilder of Python >= 3.8 (C implementation) can insert comments itself
+try:
+    ET.TreeBuilder(insert_comments=True)
+    _INSERT_COMMENTS = True
+except TypeError:
+    _INSERT_COMMENTS = False
 
-    def _end(self, tag):
-        elem = self.target.end(self._fixname(tag))
+
+class CommentTreeBuilder(object):
+    """
+    XML parser which keeps XML comments, includes comments outside root
+
+    Comments inside root node are inserted into the tree. When the C
+    implementation of TreeBuilder supports comments (Python >= 3.8), whole
+    tree is built by C code and only comments are created by Python code,
+    otherwise elements are passed to TreeBuilder by a Python target.
+    """
+
+    def __init__(self, element_factory=None):
+        # this will contain all comments in XML - see get_comments_prior_root()
+        self._commentElemList = []
+        self._root = None
+        if _INSERT_COMMENTS:
+            self._target = None
+            builder = ET.TreeBuilder(element_factory,
+                                     comment_factory=self._comment,
+                                     insert_comments=True)
+        else:
+            self._target = builder = _NoisyTarget(element_factory)
+        self._parser = ET.XMLParser(target=builder)
+
+    def _comment(self, text):
+        elem = ET.Comment(text)
         self._commentElemList.append(elem)
         return elem
 
-    def get_comments(self):
-        return self._commentElemList
+    def feed(self, data):
+        self._parser.feed(data)
+
+    def close(self):
+        self._root = self._parser.close()
+        return self._root
+
+    def get_comments_prior_root(self):
+        "Return list of comments outside root node; call it after close()."
+        if self._target is not None:
+            return self._target.comments_prior_root
+        if self._root is None:
+            return list(self._commentElemList)
+        # comments are not nested, so searching of comments is enough
+        in_root = set(self._root.iter(ET.Comment))
+        return [elem for elem in self._commentElemList
+                if elem not in in_root]
 
 
 ### ugly solution to keep an ugly license ###
@@ -122,12 +558,29 @@ class NoisyElementTree(ET.ElementTree):
         "Return False when comments outside of root node exist. Otherwise True."
         return len(self._comments_prior_root) == 0
 
+    def find_ns(self, path):
+        """
+        Return the first element matching the path relatively to the root
+        node (see NSQuery) or None.
+        """
+        return compile_query(path).find(self._root)
+
+    def findall_ns(self, path):
+        "Return list of elements matching the path (see find_ns())."
+        return compile_query(path).findall(self._root)
+
+    def iterfind_ns(self, path):
+        "Yield elements matching the path (see find_ns())."
+        return compile_query(path).iterfind(self._root)
+
     def parse(self, source, parser=None):
         if not parser:
-            parser = XMLParser(target=CommentTreeBuilder())
+            parser = CommentTreeBuilder()
         super(NoisyElementTree, self).parse(source, parser)
-        in_root_elems = set([elem for elem in self._root.iter()])
-        self._comments_prior_root = [elem for elem in parser.get_comments() if elem not in in_root_elems]
+        if hasattr(parser, "get_comments_prior_root"):
+            self._comments_prior_root = parser.get_comments_prior_root()
+        else:
+            self._comments_prior_root = []
         return self._root
 
     def write(self, file_or_filename,
@@ -135,17 +588,34 @@ class NoisyElementTree(ET.ElementTree):
               encoding=None,
               xml_declaration=None,
               default_namespace=None,
-              method=None):
+              method=None,
+              subtrees=None,
+              chunk_size=65536):
+        """
+        Write the tree with comments prior root node to the file.
+
+        Arguments are the same as for ElementTree.write(), in addition:
+        :param subtrees: iterable of elements written into the root node
+                         behind its children; so the document can be
+                         generated without holding all elements in memory
+        :param chunk_size: output is written by chunks of (about) this size
+
+        The file can be a file name, a file object (binary or text) or
+        a socket. Root node is written apart from its children and children
+        are serialized one by one, so just a chunk of the output is kept
+        in memory.
+        """
         if not method:
             method = "xml"
         elif method not in _serialize:
             # FIXME: raise an ImportError for c14n if ElementC14N is missing?
             raise ValueError("unknown method %r" % method)
-        if hasattr(file_or_filename, "write"):
-            file = file_or_filename
-        else:
+        if not hasattr(file_or_filename, "write") and not hasattr(
+                file_or_filename, "sendall"):
             file = open(file_or_filename, "wb")
-        write = file.write
+        else:
+            file = file_or_filename
+        declaration = False
         if not encoding:
             if method == "c14n":
                 encoding = "utf-8"
@@ -153,20 +623,668 @@ class NoisyElementTree(ET.ElementTree):
                 encoding = "us-ascii"
         elif xml_declaration or (xml_declaration is None and
                                  encoding not in ("utf-8", "us-ascii")):
-            if method == "xml":
-                write("<?xml version='1.0' encoding='%s'?>\n" % encoding)
-        # !!! Print ugly comments prior to root node !!!
-        for ugly_comment in self._comments_prior_root:
-            write("<!--%s-->\n" % _encode(ugly_comment.text, encoding))
-        # !!! end of ugly part
-        if method == "text":
-            _serialize[method](write, self._root, encoding)
+            declaration = method == "xml"
+        out = _ChunkWriter(file, encoding, chunk_size)
+        try:
+            if declaration:
+                out.write(_text("<?xml version='1.0' encoding='%s'?>\n"
+                                % encoding, encoding))
+            # !!! Print ugly comments prior to root node !!!
+            for ugly_comment in self._comments_prior_root:
+                out.write(_text("<!--%s-->\n" % ugly_comment.text, encoding))
+            # !!! end of ugly part
+            if method == "text":
+                for part in self._root.itertext():
+                    out.write(_text(part, encoding))
+                    out.check()
+                for subtree in subtrees or ():
+                    for part in subtree.itertext():
+                        out.write(_text(part, encoding))
+                    out.check()
+            else:
+                _write_elements(out, self._root, subtrees, encoding,
+                                default_namespace, _serialize[method])
+            out.flush()
+        finally:
+            if file_or_filename is not file:
+                file.close()
+
+
+# (namespaces, serialize) have other arguments in Python 3; output of Python 2
+# serializer is encoded already, Python 3 one writes unicode
+if _encode is not None:
+    def _text(text, encoding):
+        return _encode(text, encoding)
+
+    def _ns_maps(elem, encoding, default_namespace):
+        return _namespaces(elem, encoding, default_namespace)
+
+    def _serialize_elem(serialize, write, elem, encoding, qnames, namespaces):
+        serialize(write, elem, encoding, qnames, namespaces)
+else:
+    def _text(text, encoding):
+        return text
+
+    def _ns_maps(elem, encoding, default_namespace):
+        return _namespaces(elem, default_namespace)
+
+    def _serialize_elem(serialize, write, elem, encoding, qnames, namespaces):
+        serialize(write, elem, qnames, namespaces, short_empty_elements=True)
+
+
+class _ChunkWriter(object):
+    """
+    Collects serialized parts and writes them to the file by big chunks.
+
+    Serializers write parts by the append method of the parts list directly
+    (it is much faster than calling a Python method for every tiny part),
+    check() has to be called time to time to write the collected parts.
+    """
+
+    def __init__(self, file, encoding, chunk_size):
+        self.parts = []
+        self.write = self.parts.append
+        self.encoding = encoding
+        self._chunk_size = chunk_size
+        # number of parts with known size and the size
+        self._counted = 0
+        self._size = 0
+        if hasattr(file, "write"):
+            if isinstance(file, io.TextIOBase) and hasattr(file, "buffer"):
+                # text stream like sys.stdout - write to its binary buffer
+                file.flush()
+                file = file.buffer
+            self._write = file.write
         else:
-            qnames, namespaces = _namespaces(
-                self._root, encoding, default_namespace
-                )
-            serialize = _serialize[method]
-            serialize(write, self._root, encoding, qnames, namespaces)
-        if file_or_filename is not file:
-            file.close()
+            # socket
+            self._write = file.sendall
+
+    def check(self):
+        "Write collected parts when they are big enough."
+        parts = self.parts
+        self._size += sum(map(len, parts[self._counted:]))
+        self._counted = len(parts)
+        if self._size >= self._chunk_size:
+            self.flush()
 
+    def flush(self):
+        if not self.parts:
+            return
+        data = "".join(self.parts)
+        if not isinstance(data, bytes):
+            data = data.encode(self.encoding, "xmlcharrefreplace")
+        del self.parts[:]
+        self._counted = self._size = 0
+        self._write(data)
+
+
+_SPLIT_MARK = "NoisyElementTree.split-mark"
+
+def _write_elements(out, root, subtrees, encoding, default_namespace,
+                    serialize):
+    """
+    Serialize the root node, its children and subtrees to the _ChunkWriter.
+
+    The root node is serialized without children (with a comment as a mark
+    instead of them), so its start and end tags can be written separately.
+    An empty root node without subtrees is serialized as it is.
+    Namespaces of subtrees are declared by the subtrees themselves, as they
+    are not known when the root node is written.
+    """
+    qnames, namespaces = _ns_maps(root, encoding, default_namespace)
+    if not len(root) and not subtrees:
+        # nothing to split, keep the short form of an empty element
+        _serialize_elem(serialize, out.write, root, encoding, qnames,
+                        namespaces)
+        return
+    shell = ET.Element(root.tag, root.attrib)
+    shell.text = root.text
+    shell.tail = root.tail
+    shell.append(ET.Comment(_SPLIT_MARK))
+    parts = []
+    _serialize_elem(serialize, parts.append, shell, encoding, qnames,
+                    namespaces)
+    mark = _text("<!--%s-->" % _SPLIT_MARK, encoding)
+    start, end = "".join(parts).split(mark, 1)
+    out.write(start)
+    for child in root:
+        _serialize_elem(serialize, out.write, child, encoding, qnames, None)
+        out.check()
+    for subtree in subtrees or ():
+        sub_qnames, sub_namespaces = _ns_maps(subtree, encoding,
+                                              default_namespace)
+        _serialize_elem(serialize, out.write, subtree, encoding, sub_qnames,
+                        sub_namespaces)
+        out.check()
+    out.write(end)
+
+
+### event-driven parsing ###
+
+class _NoisyTarget(object):
+    """
+    Parser target which builds the tree like TreeBuilder and keeps comments.
+
+    Comments inside root node are inserted into the tree, comments outside of
+    root node are collected in comments_prior_root (like in NoisyElementTree).
+    When events are set, (event, element, parent) tuples of these events are
+    appended to the events list, so they can be processed during parsing.
+    """
+
+    def __init__(self, element_factory=None, events=None):
+        self._builder = ET.TreeBuilder(element_factory)
+        # opened elements
+        self._stack = []
+        self._events = set(events or ())
+        self.events = []
+        self.root = None
+        self.comments_prior_root = []
+        # number of comments before the root node
+        self.prolog_count = None
+
+    def _event(self, event, elem):
+        if event in self._events:
+            parent = self._stack[-1] if self._stack else None
+            self.events.append((event, elem, parent))
+
+    def start(self, tag, attrib):
+        elem = self._builder.start(tag, attrib)
+        if self.root is None:
+            self.root = elem
+            self.prolog_count = len(self.comments_prior_root)
+        self._event("start", elem)
+        self._stack.append(elem)
+        return elem
+
+    def end(self, tag):
+        elem = self._builder.end(tag)
+        self._stack.pop()
+        self._event("end", elem)
+        return elem
+
+    def data(self, data):
+        self._builder.data(data)
+
+    def comment(self, text):
+        if self._stack:
+            self._builder.start(ET.Comment, {})
+            self._builder.data(text)
+            elem = self._builder.end(ET.Comment)
+        else:
+            elem = ET.Comment(text)
+            self.comments_prior_root.append(elem)
+        self._event("comment", elem)
+        return elem
+
+    def close(self):
+        return self.root
+
+
+class NoisyIterParser(object):
+    """
+    Iterator over (event, element) pairs of the parsed XML, see iterparse().
+    """
+
+    def __init__(self, source, events=None, element_factory=NSElement,
+                 chunk_size=16384):
+        if events is None:
+            events = ("end",)
+        self._source = source
+        self._chunk_size = chunk_size
+        self._target = _NoisyTarget(element_factory, events)
+        # parent of the element of the last yielded event
+        self._parent = None
+
+    @property
+    def root(self):
+        "Root element; None until the root node is started."
+        return self._target.root
+
+    @property
+    def comments_prior_root(self):
+        """
+        Comments outside of root node.
+
+        Comments behind the root node are appended when they are parsed.
+        Events are reported after each chunk of the input is parsed, so
+        the list can contain them already at the "start" event of the root;
+        use prolog_comments to get just the comments before root node.
+        """
+        return self._target.comments_prior_root
+
+    @property
+    def prolog_comments(self):
+        """
+        List of comments before root node.
+
+        It is complete since the root node is started ("start" event of
+        the root) and it never contains comments behind the root node.
+        """
+        target = self._target
+        if target.prolog_count is None:
+            return target.comments_prior_root[:]
+        return target.comments_prior_root[:target.prolog_count]
+
+    def discard(self, elem):
+        """
+        Remove the element of the last yielded event from the tree.
+
+        Use it when the element has been processed already ("end" event),
+        so the memory usage doesn't grow with size of the document.
+        """
+        if self._parent is not None:
+            self._parent.remove(elem)
+        elem.clear()
+
+    def __iter__(self):
+        source = self._source
+        close_source = not hasattr(source, "read")
+        if close_source:
+            source = open(source, "rb")
+        events = self._target.events
+        try:
+            parser = ET.XMLParser(target=self._target)
+            while True:
+                data = source.read(self._chunk_size)
+                if not data:
+                    break
+                parser.feed(data)
+                for event, elem, self._parent in events:
+                    yield event, elem
+                del events[:]
+            parser.close()
+            for event, elem, self._parent in events:
+                yield event, elem
+            del events[:]
+        finally:
+            if close_source:
+                source.close()
+
+
+def iterparse(source, events=None, element_factory=NSElement):
+    """
+    Parse XML incrementally; return iterator over (event, element) pairs.
+
+    :param source: file name or file object opened in binary mode
+    :param events: list of reported events - "start", "end", "comment";
+                   only "end" events are reported by default
+    :param element_factory: factory of elements (NSElement by default)
+
+    Unlike ET.iterparse(), comments are kept: comments inside root node are
+    part of the tree, comments outside of it are accessible through
+    the comments_prior_root attribute of the iterator (comments before root
+    node only by the prolog_comments attribute). To keep the memory
+    usage low on huge documents, discard processed elements:
+
+        it = iterparse("huge.xml", events=("start", "end"))
+        for event, elem in it:
+            if event == "start" and elem is it.root:
+                license = it.prolog_comments
+            elif event == "end" and elem.tag == "item":
+                process(elem)
+                it.discard(elem)
+    """
+    return NoisyIterParser(source, events, element_factory)
+
+
+### lazy loading of sections of big files ###
+
+_ROOT_NAME_RE = re.compile(br"<([^\s/>]+)")
+
+def _expat_tag(name):
+    "Return ElementTree tag of the name reported by expat with namespaces."
+    return "{" + name if "}" in name else name
+
+
+class _IndexBuilder(object):
+    """
+    Expat handlers recording byte offsets of the root node and its children.
+
+    Expat reports the offset where the event starts, so the end of a child
+    (or of the root start tag) is the offset of the next event.
+    """
+
+    def __init__(self):
+        import xml.parsers.expat
+        self.parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CommentHandler = self.comment
+        self.parser.CharacterDataHandler = self.other
+        self.parser.ProcessingInstructionHandler = self.other
+        self.parser.StartCdataSectionHandler = self.other
+        self.depth = 0
+        self.root_start = -1
+        self.root_start_end = -1
+        self.children = []
+        self.comments = []
+        # list of [tag, start, end] waiting for its end or None
+        self._pending = None
+
+    def _mark(self):
+        if self._pending is not None:
+            self._pending[-1] = self.parser.CurrentByteIndex
+            self._pending = None
+
+    def start(self, name, attrib):
+        self._mark()
+        self.depth += 1
+        if self.depth == 1:
+            self.root_start = self.parser.CurrentByteIndex
+            self._pending = ["root", self.root_start, -1]
+            self._root = self._pending
+        elif self.depth == 2:
+            self.children.append([_expat_tag(name),
+                                  self.parser.CurrentByteIndex, -1])
+
+    def end(self, name):
+        self._mark()
+        self.depth -= 1
+        if self.depth == 1:
+            self._pending = self.children[-1]
+        elif self.depth == 0:
+            # the same as root_start for empty root node (<root/>), but
+            # it has no children to parse then
+            self.root_start_end = self._root[-1]
+
+    def comment(self, data):
+        self._mark()
+        if self.depth == 0:
+            self.comments.append(data)
+
+    def other(self, *args):
+        self._mark()
+
+
+class XMLIndex(object):
+    """
+    Byte offsets of children of the root node and comments outside root.
+
+    :ivar root_start: offset of the root start tag
+    :ivar root_start_end: offset behind the root start tag
+    :ivar children: list of (tag, start, end) of root children; tags are
+                    in the ElementTree form ("{namespace}name")
+    :ivar comments: texts of comments outside root node
+    :ivar size, mtime: size and mtime of the indexed file
+
+    The index can be saved to a sidecar file (JSON), see save().
+    """
+
+    def __init__(self, root_start, root_start_end, children, comments,
+                 size=-1, mtime=-1):
+        self.root_start = root_start
+        self.root_start_end = root_start_end
+        self.children = [tuple(child) for child in children]
+        self.comments = comments
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def build(cls, filename):
+        "Index the file by one walk through it."
+        st = os.stat(filename)
+        builder = _IndexBuilder()
+        with open(filename, "rb") as fp:
+            builder.parser.ParseFile(fp)
+        return cls(builder.root_start, builder.root_start_end,
+                   builder.children, builder.comments,
+                   st.st_size, st.st_mtime)
+
+    def is_valid_for(self, filename):
+        "Return True when the file has not been changed since indexing."
+        st = os.stat(filename)
+        return (st.st_size, st.st_mtime) == (self.size, self.mtime)
+
+    def save(self, filename):
+        with open(filename, "w") as fp:
+            json.dump({
+                "root_start": self.root_start,
+                "root_start_end": self.root_start_end,
+                "children": self.children,
+                "comments": self.comments,
+                "size": self.size,
+                "mtime": self.mtime,
+            }, fp)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as fp:
+            return cls(**json.load(fp))
+
+
+class LazyNoisyElementTree(object):
+    """
+    Big XML file with children of root node parsed on demand.
+
+    Only the index of the file (see XMLIndex) is created at the beginning,
+    sections - children of the root node - are parsed when requested,
+    directly from the mmap-ed file. So the time to get a section doesn't
+    depend on the size of the file (when the index exists already).
+    E.g.
+        with LazyNoisyElementTree("rc.xml", sidecar="rc.xml.idx") as tree:
+            keyboard = tree.find_section("keyboard")
+
+    Sections are parsed together with the prolog and the root start tag,
+    so namespaces and entities declared there are resolved. Comments inside
+    sections are kept like by NoisyElementTree.parse().
+    """
+
+    def __init__(self, filename, index=None, sidecar=None):
+        """
+        :param index: XMLIndex of the file; created when not set
+        :param sidecar: file name of the stored index; it is used when it
+                        is up to date, otherwise it is created again
+        """
+        if index is None and sidecar is not None and os.path.exists(sidecar):
+            index = XMLIndex.load(sidecar)
+            if not index.is_valid_for(filename):
+                index = None
+        if index is None:
+            index = XMLIndex.build(filename)
+            if sidecar is not None:
+                index.save(sidecar)
+        self.index = index
+        self._file = open(filename, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # tag / local name -> numbers of children
+        self._by_tag = {}
+        for num, child in enumerate(index.children):
+            self._by_tag.setdefault(child[0], []).append(num)
+            local = _split_tag(child[0])[1]
+            if local != child[0]:
+                self._by_tag.setdefault(local, []).append(num)
+        # prolog with the root start tag and the root end tag, see get_section()
+        self._head = self._tail = None
+        self._comments = [ET.Comment(text) for text in index.comments]
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_comments_prior_root(self):
+        return self._comments
+
+    def is_valid_tree(self):
+        "Return False when comments outside of root node exist. Otherwise True."
+        return len(self._comments) == 0
+
+    def sections(self):
+        "Return list of tags of all sections (children of root node)."
+        return [child[0] for child in self.index.children]
+
+    def get_section(self, num):
+        "Parse and return the num-th section."
+        tag, start, end = self.index.children[num]
+        if self._head is None:
+            index = self.index
+            start_tag = self._mm[index.root_start:index.root_start_end]
+            self._head = self._mm[:index.root_start] + start_tag
+            self._tail = (b"</" + _ROOT_NAME_RE.match(start_tag).group(1)
+                          + b">")
+        parser = CommentTreeBuilder()
+        parser.feed(self._head)
+        parser.feed(self._mm[start:end])
+        parser.feed(self._tail)
+        return parser.close()[0]
+
+    def iter_sections(self, tag=None):
+        """
+        Yield sections with the tag - with or without namespace ("{ns}name"
+        or "name") - or all sections when tag is not set.
+        """
+        if tag is None:
+            nums = range(len(self.index.children))
+        else:
+            nums = self._by_tag.get(tag, [])
+        for num in nums:
+            yield self.get_section(num)
+
+    def find_section(self, tag):
+        "Return the first section with the tag (see iter_sections()) or None."
+        nums = self._by_tag.get(tag, None)
+        return self.get_section(nums[0]) if nums else None
+
+
+### batch transformations ###
+
+def _load_transform(transform):
+    "Return the transform function; import it when given as 'module:name'."
+    if callable(transform):
+        return transform
+    import importlib
+    module, name = transform.split(":", 1)
+    return getattr(importlib.import_module(module), name)
+
+# XML declaration (with BOM and newline) at the start of the file
+_XML_DECLARATION_RE = re.compile(br"(?:\xef\xbb\xbf)?(<\?xml\s[^>]*\?>)(?:\r?\n)?")
+_DECLARED_ENCODING_RE = re.compile(br"""encoding\s*=\s*["']([^"']+)""")
+
+def transform_file(source, transform, output=None, encoding="utf-8",
+                   xml_declaration=None):
+    """
+    Parse the file, transform it and write it with comments prior root.
+
+    :param transform: function(tree) which modifies the NoisyElementTree
+                      in place or returns a new one; or 'module:function'
+    :param output: output file name; the source file is rewritten by default
+    :param xml_declaration: True or False to write the XML declaration
+                      or not; by default the declaration of the source
+                      is kept as it is (and its encoding is used)
+    Whitespaces behind the root node of the source are kept, so a file is
+    not changed by a transformation which does not change anything.
+    Return tuple (source, status, seconds), where status is "written",
+    "unchanged" (the output has the same content already, so it has not
+    been touched) or "error: <message>".
+
+    The output is written into a temporary file first and renamed then,
+    so the output file is never written partially.
+    """
+    start = time.time()
+    if output is None:
+        output = source
+    try:
+        with open(source, "rb") as fp:
+            raw = fp.read()
+        tree = NoisyElementTree()
+        tree.parse(io.BytesIO(raw))
+        tree = _load_transform(transform)(tree) or tree
+        buf = io.BytesIO()
+        declaration = None
+        if xml_declaration is None:
+            declaration = _XML_DECLARATION_RE.match(raw)
+        if declaration is not None:
+            buf.write(declaration.group(0))
+            declared = _DECLARED_ENCODING_RE.search(declaration.group(1))
+            encoding = declared.group(1).decode("ascii") if declared else "utf-8"
+            xml_declaration = False
+        tree.write(buf, encoding=encoding, xml_declaration=xml_declaration)
+        buf.write(raw[len(raw.rstrip()):])
+        data = buf.getvalue()
+        if os.path.exists(output):
+            with open(output, "rb") as fp:
+                if fp.read() == data:
+                    return source, "unchanged", time.time() - start
+        _write_atomically(output, data)
+    except Exception as e:
+        return source, "error: %s" % e, time.time() - start
+    return source, "written", time.time() - start
+
+def _write_atomically(path, data):
+    import tempfile
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp-",
+                               suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        if os.path.exists(path):
+            import shutil
+            shutil.copymode(path, tmp)
+        else:
+            # mkstemp() creates the file with mode 0600; use the mode
+            # which open() would give to the new file
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _transform_job(args):
+    return transform_file(*args)
+
+def transform_files(files, transform, output_dir=None, processes=None,
+                    encoding="utf-8", xml_declaration=None):
+    """
+    Transform files by transform_file() in parallel; yield their results.
+
+    :param transform: function(tree) or 'module:function'; it has to be
+                      importable by worker processes (defined on a module
+                      level, not a lambda)
+    :param output_dir: outputs are written into the directory, with paths
+                       relative to the common directory of the files;
+                       files are rewritten by default
+    :param processes: number of worker processes; files are transformed
+                      in the current process when it is 1, default is
+                      number of CPUs
+
+    Results are yielded as soon as files are done, so not in the order
+    of files.
+    """
+    files = list(files)
+    if output_dir is None:
+        outputs = files
+    else:
+        paths = [os.path.abspath(path) for path in files]
+        base = os.path.dirname(os.path.commonprefix(paths))
+        outputs = [os.path.join(output_dir, os.path.relpath(path, base))
+                   for path in paths]
+    jobs = [(path, transform, out, encoding, xml_declaration)
+            for path, out in zip(files, outputs)]
+    if processes is None:
+        import multiprocessing
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _transform_job(job)
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, min(16, len(jobs) // (processes * 4)))
+        for result in pool.imap_unordered(_transform_job, jobs, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
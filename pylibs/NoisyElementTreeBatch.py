@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+"""
+Transform many XML files in parallel, keeping comments prior root node.
+
+The transformation is a function taking NoisyElementTree, given as
+'module:function' (the module has to be importable, e.g. from the current
+directory). Every file is parsed, transformed and written atomically; files
+which would not change are not touched. E.g.
+
+    ./NoisyElementTreeBatch.py -t mytransforms:bump_version -j 8 conf/*.xml
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+import NoisyElementTree as NET
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Transform XML files in parallel, keeping comments "
+                    "prior root node.")
+    parser.add_argument("files", nargs="+", help="XML files to transform")
+    parser.add_argument("-t", "--transform", required=True,
+                        metavar="MODULE:FUNCTION",
+                        help="function transforming NoisyElementTree")
+    parser.add_argument("-o", "--output-dir",
+                        help="write results into the directory instead of "
+                             "rewriting the files")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: number "
+                             "of CPUs)")
+    parser.add_argument("--encoding", default="utf-8",
+                        help="encoding of output files without kept XML "
+                             "declaration (default: utf-8)")
+    parser.add_argument("--xml-declaration", action="store_true",
+                        default=None, help="always write XML declaration "
+                        "(by default it is kept as in the source files)")
+    parser.add_argument("--no-xml-declaration", action="store_false",
+                        dest="xml_declaration",
+                        help="never write XML declaration")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="print just errors and the summary")
+    args = parser.parse_args(argv)
+
+    # worker processes import the transformation too
+    sys.path.insert(0, os.getcwd())
+    try:
+        NET._load_transform(args.transform)
+    except (ImportError, AttributeError, ValueError) as e:
+        parser.error("cannot load transform %s: %s" % (args.transform, e))
+
+    start = time.time()
+    counts = {}
+    cpu_time = 0.0
+    for path, status, secs in NET.transform_files(
+            args.files, args.transform, args.output_dir, args.jobs,
+            args.encoding, args.xml_declaration):
+        key = "error" if status.startswith("error") else status
+        counts[key] = counts.get(key, 0) + 1
+        cpu_time += secs
+        if key == "error" or not args.quiet:
+            print("%8.3fs %-9s %s" % (secs, status, path))
+    wall_time = time.time() - start
+    print("%d written, %d unchanged, %d errors; %.2fs (%.2fs in workers)" % (
+        counts.get("written", 0), counts.get("unchanged", 0),
+        counts.get("error", 0), wall_time, cpu_time))
+    return 1 if counts.get("error") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
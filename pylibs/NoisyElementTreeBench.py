@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+"""
+Benchmark of parsing by NoisyElementTree on large generated documents.
+
+Compares the comment-preserving parser (CommentTreeBuilder) with the Python
+target which passes every element to TreeBuilder by Python code (the only
+way before TreeBuilder supported comments) and with plain ET.parse(), which
+drops comments:
+
+    ./NoisyElementTreeBench.py -n 10000 -n 100000 -o results.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+import time
+from io import BytesIO
+
+import NoisyElementTree as NET
+from NoisyElementTree import ET
+
+
+def generate_document(items, comments=0.05):
+    """
+    Return XML document (bytes) with the given number of items.
+
+    License comment is placed before root node, other comments are spread
+    inside the document with the given density.
+    """
+    out = [b"<?xml version='1.0' encoding='utf-8'?>\n",
+           b"<!-- Copyright (C) Somebody\n  Licensed under whatever -->\n",
+           b"<config xmlns='http://example.com/config'>\n"]
+    every = int(1 / comments) if comments else 0
+    for i in range(items):
+        if every and i % every == 0:
+            out.append(b"  <!-- item %d -->\n" % i)
+        out.append(b"  <item id='%d'><name>item%d</name>"
+                   b"<value type='int'>%d</value></item>\n" % (i, i, i * 7))
+    out.append(b"</config>\n")
+    return b"".join(out)
+
+
+def _parse_noisy(data):
+    tree = NET.NoisyElementTree()
+    tree.parse(BytesIO(data))
+    return tree.get_comments_prior_root()
+
+def _parse_python_target(data):
+    target = NET._NoisyTarget()
+    parser = ET.XMLParser(target=target)
+    parser.feed(data)
+    parser.close()
+    return target.comments_prior_root
+
+def _parse_plain(data):
+    return ET.parse(BytesIO(data)).getroot()
+
+PARSERS = [
+    ("CommentTreeBuilder", _parse_noisy),
+    ("python target", _parse_python_target),
+    ("ET.parse", _parse_plain),
+]
+
+
+def _timeit(func, repeat):
+    "Return the best time of the repeated calls."
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(sizes, repeat=3, log=None):
+    "Run benchmarks for all sizes and return list of results (dicts)."
+    results = []
+    for items in sizes:
+        data = generate_document(items)
+        for name, func in PARSERS:
+            secs = _timeit(lambda: func(data), repeat)
+            results.append({
+                "items": items,
+                "size": len(data),
+                "parser": name,
+                "seconds": secs,
+                "mb_per_s": len(data) / 1e6 / secs if secs else None,
+            })
+            if log is not None:
+                log.write("%9d items %-20s %8.4fs %8.2f MB/s\n" % (
+                    items, name, secs, results[-1]["mb_per_s"] or 0))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark parsing by NoisyElementTree.")
+    parser.add_argument("-n", "--items", type=int, action="append",
+                        help="number of items in the document (more "
+                             "sizes can be given)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="number of runs (best is taken)")
+    parser.add_argument("-o", "--output", help="save results as JSON")
+    args = parser.parse_args(argv)
+
+    sizes = args.items or [10000, 100000, 500000]
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "insert_comments": NET._INSERT_COMMENTS,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": run(sizes, args.repeat, log=sys.stdout),
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,435 @@
+#!/usr/bin/python
+
+"""
+Checks of NoisyElementTree against the plain ElementTree.
+
+Every feature which reimplements something ElementTree does already is
+compared with ElementTree on generated documents - namespace-agnostic
+queries with findall(), the chunked write() with ElementTree.write(), lazily
+parsed sections and iterparse() with the full parse, queries of the NSIndex
+after mutations of the tree - and batch transformations are checked on
+temporary files:
+
+    ./NoisyElementTreeCheck.py                 # run all checks
+    ./NoisyElementTreeCheck.py queries write   # run just the given checks
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import shutil
+import stat
+import sys
+import tempfile
+from io import BytesIO
+
+import NoisyElementTree as NET
+from NoisyElementTree import ET
+
+NS = "http://example.com/config"
+
+def generate_document(sections=4, items=3):
+    """
+    Return XML document (bytes) in the NS namespace with comments outside
+    and inside root node; items of sections have keys "k0", "k1", ...
+    Odd sections contain a note in other namespace too. Comments inside
+    root node are in values, so they are not counted by [n] of ElementTree.
+    """
+    out = [b"<?xml version='1.0' encoding='utf-8'?>\n",
+           b"<!-- Copyright (C) Somebody -->\n",
+           b"<!-- Licensed under whatever -->\n",
+           b"<config xmlns='" + NS.encode("ascii") + b"' xmlns:o='urn:other'>\n"]
+    key = 0
+    for i in range(sections):
+        out.append(b"  <section name='s%d'>\n" % i)
+        if i % 2:
+            out.append(b"    <o:note>other</o:note>\n")
+        for j in range(items):
+            comment = b"<!-- section %d -->" % i if j == 1 else b""
+            out.append(b"    <item key='k%d'><value>%d%s</value></item>\n"
+                       % (key, j, comment))
+            key += 1
+        out.append(b"  </section>\n")
+        out.append(b"  <item key='top%d'/>\n" % i)
+    out.append(b"</config>\n<!-- trailing -->\n")
+    return b"".join(out)
+
+def _parse(data):
+    tree = NET.NoisyElementTree()
+    tree.parse(BytesIO(data), NET.CommentTreeBuilder(NET.NSElement))
+    return tree
+
+def _expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+def _same(got, expected, what):
+    """
+    Raise AssertionError when the lists do not contain the same elements;
+    comments in the expected list (found by "*" of ElementTree) are ignored.
+    """
+    expected = [e for e in expected if isinstance(e.tag, str)]
+    if len(got) != len(expected) or any(
+            a is not b for a, b in zip(got, expected)):
+        raise AssertionError("%s: %d elements %r != expected %d %r" % (
+            what, len(got), [e.tag for e in got][:5],
+            len(expected), [e.tag for e in expected][:5]))
+
+def _qualified(path):
+    "Return ElementTree path with names of the path in the NS namespace."
+    return re.sub(r"(^|/)([a-z]\w*)", r"\1{%s}\2" % NS, path)
+
+def _local(elem):
+    return elem.tag.rsplit("}", 1)[-1] if isinstance(elem.tag, str) else None
+
+def _dump(elem):
+    "Return serialized element without its tail."
+    tail, elem.tail = elem.tail, None
+    try:
+        return ET.tostring(elem)
+    finally:
+        elem.tail = tail
+
+# paths of NSQuery; ElementTree gets them with qualified names (its [n]
+# counts siblings with the same tag, so it is not used after "*")
+QUERIES = [
+    ".",
+    "section",
+    "section/item",
+    ".//item",
+    ".//value",
+    "section/item[2]",
+    "section[3]/item[1]",
+    ".//item[1]",
+    ".//item[3]",
+    "section[@name='s1']/item",
+    "section[@name]/item[@key='k4']",
+    ".//item[@key]",
+    "section/*",
+    "section//value",
+    "section/item/value[1]",
+]
+
+def check_queries():
+    """
+    NSQuery finds the same elements as findall() of ElementTree.
+    """
+    root = _parse(generate_document()).getroot()
+    for indexed in (False, True):
+        if indexed:
+            root.build_ns_index()
+        for path in QUERIES:
+            expected = root.findall(_qualified(path))
+            _same(root.findall_ns(path), expected,
+                  "%s%s" % (path, " (indexed)" if indexed else ""))
+            _same(list(root.iterfind_ns(path)), expected, path)
+            _expect(root.find_ns(path) is (expected[0] if expected else None),
+                    "find_ns(%r) is not the first match" % path)
+        _same(root.findall_ns(".//note"), root.findall(".//{urn:other}note"),
+              ".//note")
+        _same(root.findall_ns("section/*[2]"),
+              [[e for e in section if isinstance(e.tag, str)][1]
+               for section in root.findall(_qualified("section"))],
+              "section/*[2]")
+    # the same local names in more namespaces
+    root = _parse(b"<r xmlns:o='urn:other'><a/><o:a/><b><o:a/>"
+                  b"<a/><a xmlns='urn:x'/></b></r>").getroot()
+    for indexed in (False, True):
+        if indexed:
+            root.build_ns_index()
+        for path in ("{urn:other}a", "{urn:x}a", "{}a", "{}b/{}a"):
+            _same(root.findall_ns(".//" + path),
+                  root.findall(".//" + path.replace("{}", "")), path)
+        _same(root.findall_ns(".//a"),
+              [e for e in root.iter() if _local(e) == "a"], ".//a")
+        _same(list(root.iter_ignore_ns("a")),
+              [e for e in root.iter() if _local(e) == "a"], "iter_ignore_ns")
+    print("  %d queries" % (len(QUERIES) + 7))
+
+def _written(tree, **kwargs):
+    out = BytesIO()
+    tree.write(out, **kwargs)
+    return out.getvalue()
+
+def check_write():
+    """
+    Chunked write() gives the same output as ElementTree.write().
+    """
+    data = generate_document(sections=50)
+    trees = [
+        _parse(data).getroot(),
+        _parse(b"<r/>").getroot(),
+        _parse(b"<r a='1'>text</r>").getroot(),
+        _parse(b"<r><!-- only comment --></r>").getroot(),
+        _parse(b"<r xmlns='urn:x'><a/>tail</r>").getroot(),
+    ]
+    count = 0
+    for root in trees:
+        for kwargs in ({}, {"encoding": "utf-8"},
+                       {"encoding": "us-ascii", "xml_declaration": True},
+                       {"encoding": "iso-8859-1"}, {"method": "html"},
+                       {"method": "text"}):
+            expected = _written(ET.ElementTree(root), **kwargs)
+            for chunk_size in (1, 7, 65536):
+                got = _written(NET.NoisyElementTree(root), chunk_size=chunk_size,
+                               **kwargs)
+                _expect(got == expected, "%r %r (chunks %d): %r != expected %r"
+                        % (root.tag, kwargs, chunk_size, got[:200],
+                           expected[:200]))
+                count += 1
+    # subtrees are written into the root behind its children
+    for text in (b"<r/>", b"<r>x<a/></r>"):
+        subtrees = [ET.Element("s%d" % i, {"n": str(i)}) for i in range(3)]
+        got = _written(NET.NoisyElementTree(_parse(text).getroot()),
+                       subtrees=iter(subtrees), chunk_size=5)
+        root = _parse(text).getroot()
+        root.extend(subtrees)
+        expected = _written(ET.ElementTree(root))
+        _expect(got == expected, "subtrees of %r: %r != expected %r"
+                % (text, got, expected))
+        count += 1
+    # comments outside root are written before it
+    tree = _parse(data)
+    got = _written(tree, encoding="utf-8", xml_declaration=False)
+    comments = b"".join(b"<!--" + c.text.encode("utf-8") + b"-->\n"
+                        for c in tree.get_comments_prior_root())
+    _expect(len(tree.get_comments_prior_root()) == 3,
+            "comments outside root are not parsed")
+    _expect(got.startswith(comments), "comments prior root are missing")
+    _expect(got[len(comments):] == _written(ET.ElementTree(tree.getroot()),
+                                            encoding="utf-8"),
+            "tree with comments prior root differs")
+    print("  %d outputs" % (count + 1))
+
+def check_lazy():
+    """
+    Lazily parsed sections are the same as children of the full parse.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "config.xml")
+        with open(path, "wb") as fp:
+            fp.write(generate_document(sections=20))
+        full = NET.NoisyElementTree()
+        full.parse(path)
+        children = list(full.getroot())
+        sidecar = path + ".idx"
+        for run in ("index built", "index loaded"):
+            with NET.LazyNoisyElementTree(path, sidecar=sidecar) as lazy:
+                _expect(lazy.sections() == [child.tag for child in children],
+                        "%s: sections differ" % run)
+                for num, child in enumerate(children):
+                    _expect(_dump(lazy.get_section(num)) == _dump(child),
+                            "%s: section %d differs" % (run, num))
+                _expect([c.text for c in lazy.get_comments_prior_root()] ==
+                        [c.text for c in full.get_comments_prior_root()],
+                        "%s: comments outside root differ" % run)
+                for tag in ("item", "{%s}section" % NS, "missing"):
+                    got = [_dump(e) for e in lazy.iter_sections(tag)]
+                    expected = [_dump(e) for e in children
+                                if tag in (e.tag, _local(e))]
+                    _expect(got == expected, "%s: sections %r differ"
+                            % (run, tag))
+                    found = lazy.find_section(tag)
+                    _expect((found is None and not expected) or
+                            _dump(found) == expected[0],
+                            "%s: find_section(%r) differs" % (run, tag))
+        print("  %d sections" % len(children))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def check_iterparse():
+    """
+    iterparse() builds the same tree and comments as the full parse.
+    """
+    data = generate_document(sections=10)
+    full = _parse(data)
+    prolog = [c.text for c in full.get_comments_prior_root()][:2]
+    for chunk_size in (1, 13, 16384):
+        it = NET.NoisyIterParser(BytesIO(data), ("start", "end"),
+                                 chunk_size=chunk_size)
+        at_start = None
+        for event, elem in it:
+            if event == "start" and elem is it.root:
+                at_start = [c.text for c in it.prolog_comments]
+        _expect(at_start == prolog, "chunks %d: prolog comments %r at start "
+                "of root != %r" % (chunk_size, at_start, prolog))
+        _expect([c.text for c in it.prolog_comments] == prolog,
+                "chunks %d: prolog comments contain comments behind root"
+                % chunk_size)
+        _expect([c.text for c in it.comments_prior_root] ==
+                [c.text for c in full.get_comments_prior_root()],
+                "chunks %d: comments outside root differ" % chunk_size)
+        _expect(ET.tostring(it.root) == ET.tostring(full.getroot()),
+                "chunks %d: trees differ" % chunk_size)
+
+def _check_index(root, what):
+    "Compare results of the indexed queries with ElementTree."
+    for path in (".//value", "section/value", ".//*"):
+        _same(root.findall_ns(path), root.findall(_qualified(path)),
+              "%s: %s" % (what, path))
+    path = ".//{%s}item" % NS
+    _same(root.findall_ns(path), root.findall(path), "%s: %s" % (what, path))
+    for elem in root.iter():
+        # ET.SubElement() of Python 3 creates plain Elements
+        if not isinstance(elem, NET.NSElement):
+            continue
+        _same(list(elem.iter_ignore_ns("item")),
+              [e for e in elem.iter() if _local(e) == "item"],
+              "%s: iter_ignore_ns() of %s" % (what, elem.tag))
+
+def check_index():
+    """
+    Queries answered by NSIndex follow mutations of the tree.
+    """
+    item = "{%s}item" % NS
+    mutations = [
+        ("append", lambda root: root[0].append(root.makeelement(item, {}))),
+        ("insert", lambda root: root.insert(0, root.makeelement(item, {}))),
+        ("extend", lambda root: root[2].extend(
+            [root.makeelement(item, {}) for _ in range(3)])),
+        ("remove", lambda root: root[0].remove(root[0][-1])),
+        ("setitem", lambda root: root.__setitem__(1, root.makeelement(item, {}))),
+        ("delitem", lambda root: root.__delitem__(0)),
+        ("clear", lambda root: root[0].clear()),
+        ("SubElement", lambda root: NET.SubElement(root[1], item).append(
+            root.makeelement("{%s}value" % NS, {}))),
+        ("ET.SubElement of root", lambda root: ET.SubElement(root, item)),
+    ]
+    for name, mutate in mutations:
+        root = _parse(generate_document()).getroot()
+        index = root.build_ns_index()
+        _check_index(root, "before %s" % name)
+        mutate(root)
+        _check_index(root, "after %s" % name)
+        _expect(root._ns_index is index, "%s: index was dropped" % name)
+    # changes the index cannot notice are fixed by invalidate()
+    root = _parse(generate_document()).getroot()
+    index = root.build_ns_index()
+    ET.SubElement(root[0][0], item)
+    root[2][0].tag = "{%s}renamed" % NS
+    index.invalidate()
+    _check_index(root, "after invalidate()")
+    print("  %d mutations" % len(mutations))
+
+def bump_version(tree):
+    "Transformation of check_batch(): set the version attribute of root."
+    tree.getroot().set("version", "2")
+
+def keep(tree):
+    "Transformation of check_batch() which changes nothing."
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def check_batch():
+    """
+    Batch transformation writes just changed files, keeping their modes.
+    """
+    sources = {
+        "declared.xml": b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                        b'<!-- LICENSE -->\n<r>..</r>\n',
+        "latin.xml": b"<?xml version='1.0' encoding='iso-8859-1'?>\n"
+                     b"<r>\xe9</r>\n",
+        "plain.xml": b"<r><a /></r>",
+        "sub/nested.xml": b'<r version="2" />\n',
+    }
+    tmpdir = tempfile.mkdtemp()
+    umask = os.umask(0o027)
+    try:
+        paths = []
+        for name, data in sorted(sources.items()):
+            path = os.path.join(tmpdir, "in", name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as fp:
+                fp.write(data)
+            os.chmod(path, 0o600)
+            paths.append(path)
+        module = __name__ if __name__ != "__main__" else "NoisyElementTreeCheck"
+        for processes in (1, 2):
+            results = NET.transform_files(paths, module + ":keep",
+                                          processes=processes)
+            for path, status, _ in results:
+                _expect(status == "unchanged", "keep: %s %s" % (path, status))
+        for path in paths:
+            name = os.path.relpath(path, os.path.join(tmpdir, "in"))
+            with open(path, "rb") as fp:
+                _expect(fp.read() == sources[name], "%s was changed" % name)
+
+        out = os.path.join(tmpdir, "out")
+        for run in ("new files", "the same output"):
+            results = dict((os.path.relpath(path, tmpdir), status)
+                           for path, status, _ in NET.transform_files(
+                               paths, module + ":bump_version", out, 2))
+            for path, status in results.items():
+                expected = "written" if run == "new files" else "unchanged"
+                _expect(status == expected, "%s: %s %s" % (run, path, status))
+        for name in sources:
+            path = os.path.join(out, name)
+            _expect(_mode(path) == 0o640, "new %s has mode %o, not 640 of "
+                    "the umask" % (name, _mode(path)))
+        with open(os.path.join(out, "declared.xml"), "rb") as fp:
+            _expect(fp.read() == b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                    b'<!-- LICENSE -->\n<r version="2">..</r>\n',
+                    "declaration or newline of declared.xml is lost")
+        with open(os.path.join(out, "latin.xml"), "rb") as fp:
+            _expect(fp.read() == b"<?xml version='1.0' encoding='iso-8859-1'?>"
+                    b'\n<r version="2">\xe9</r>\n',
+                    "latin.xml is not written in its encoding")
+
+        results = list(NET.transform_files(paths, module + ":bump_version",
+                                           processes=1))
+        written = sorted(os.path.relpath(path, tmpdir)
+                         for path, status, _ in results if status == "written")
+        _expect(written == [os.path.join("in", name) for name in
+                            ("declared.xml", "latin.xml", "plain.xml")],
+                "rewritten files: %s" % written)
+        for path in paths:
+            _expect(_mode(path) == 0o600, "mode of rewritten %s is %o"
+                    % (path, _mode(path)))
+    finally:
+        os.umask(umask)
+        shutil.rmtree(tmpdir)
+
+CHECKS = [
+    ("queries", check_queries),
+    ("write", check_write),
+    ("lazy", check_lazy),
+    ("iterparse", check_iterparse),
+    ("index", check_index),
+    ("batch", check_batch),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check NoisyElementTree against ElementTree.")
+    parser.add_argument("checks", nargs="*", metavar="CHECK",
+                        help="checks to run: %s (default: all)"
+                             % ", ".join(name for name, _ in CHECKS))
+    args = parser.parse_args(argv)
+
+    checks = dict(CHECKS)
+    unknown = [name for name in args.checks if name not in checks]
+    if unknown:
+        parser.error("unknown checks: %s" % ", ".join(unknown))
+    failed = 0
+    for name, check in CHECKS:
+        if args.checks and name not in args.checks:
+            continue
+        print("%s: %s" % (name, check.__doc__.strip()))
+        try:
+            check()
+        except AssertionError as e:
+            print("  FAILED: %s" % e)
+            failed += 1
+            continue
+        print("  OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,36 @@ def get_owner_from_config():
     # is the owner of the project. So set the user as owner from the config file.
     return client.config['username']
 
+
+# number of builds requested at once
+BUILDS_PAGE_SIZE = 100
+
+
+def iter_builds(client, ownername, projectname, submitted_before=None, page_size=BUILDS_PAGE_SIZE):
+    """
+    Yield builds of the project lazily, the oldest first.
+
+    Builds are requested in pages ordered by id, so just one page is kept in
+    memory. Ids grow with the time of submission, so when submitted_before
+    (timestamp) is given, no more pages are requested after the first build
+    submitted later. Builds must not be deleted while iterating (offsets
+    of next pages would move), collect their ids first.
+    """
+    offset = 0
+    while True:
+        page = client.build_proxy.get_list(
+            ownername=ownername,
+            projectname=projectname,
+            pagination={'order': 'id', 'order_type': 'ASC', 'limit': page_size, 'offset': offset},
+        )
+        for build in page:
+            if submitted_before is not None and build.submitted_on >= submitted_before:
+                return
+            yield build
+        if len(page) < page_size:
+            return
+        offset += page_size
+
 #ENV_VARS = {
 #    '_COPR_CONFIG': '~/.config/copr',  # Copr config file. Get it through https://<copr instance>/api/.
 #    'COPR_OWNER': None,  # Owner of the Copr project
@@ -47,14 +77,9 @@ CONFIG_PATH = os.path.expanduser("~/.config/copr_rh_oamg.conf")
 if not os.path.exists(CONFIG_PATH):
     print("The COPR 'config' (API token) file not found: {}.".format(CONFIG_PATH), file=sys.stderr)
 client = copr.v3.Client(copr.v3.config_from_file(path=CONFIG_PATH))
-build_list = client.build_proxy.get_list(
-    ownername=client.config['username'],
-    projectname='leapp',
-    pagination={'order': 'id', 'limit': None},
-)
 since_ts = datetime.timestamp(datetime.strptime("2020-06-01", "%Y-%m-%d"))
-filtered_build_list = [i for i in build_list if i.submitted_on < since_ts]
-builds_ids = [build.id for build in filtered_build_list]
+builds_ids = [build.id for build in iter_builds(
+    client, client.config['username'], 'leapp', submitted_before=since_ts)]
 
 
 
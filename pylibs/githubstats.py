@@ -1,25 +1,114 @@
 #!/usr/bin/python3
 
+import argparse
+import csv
+import json
+import logging
+import math
 import os
+import random
+import re
 import socket
+import sqlite3
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 
-from github import Github
+from github import Github, GithubException, RateLimitExceededException
 
 GH_TOKEN='<your-token>'
 
+# number of threads fetching data of pull requests in parallel
+DEFAULT_WORKERS = 8
+
+# number of repositories collected in parallel (each by DEFAULT_WORKERS)
+DEFAULT_REPO_WORKERS = 4
+
+# file with data of already seen pull requests (see StatsCache)
+CACHE_PATH = os.path.expanduser('~/.cache/githubstats.sqlite')
+
+# ways of collecting data of pull requests: REST API needs several requests
+# per pull request, GraphQL API gets pages of pulls with all the data
+BACKEND_REST = "rest"
+BACKEND_GRAPHQL = "graphql"
+_BACKENDS = (BACKEND_REST, BACKEND_GRAPHQL)
+
+# sizes of nested pages of the GraphQL query; pulls with more reviews or
+# review comments are fetched by REST API
+GRAPHQL_PAGE_SIZES = {"pulls": 50, "reviews": 50, "comments": 50}
+
+_PULLS_QUERY = """
+query ($owner: String!, $name: String!, $cursor: String, $order: IssueOrder!,
+       $pulls: Int!, $reviews: Int!, $comments: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: $pulls, after: $cursor,
+                 orderBy: $order) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number
+        updatedAt
+        author { login }
+        mergedBy { login }
+        mergedAt
+        reviews(first: $reviews) {
+          pageInfo { hasNextPage }
+          nodes {
+            author { login }
+            submittedAt
+            comments(first: $comments) {
+              pageInfo { hasNextPage }
+              nodes { author { login } createdAt }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# time periods of statistics (see StatsAggregator), functions return
+# the period of the timestamp (see _timestamp())
+WINDOWS = {
+    "year": lambda at: at[:4],
+    "month": lambda at: at[:7],
+    "week": lambda at: "{}-W{:02d}".format(*datetime.strptime(at[:10], "%Y-%m-%d").isocalendar()[:2]),
+    "day": lambda at: at[:10],
+}
+
 class AuthenticationError(Exception):
     pass
 
 
+class UnitFailedError(Exception):
+    """
+    A unit of work failed even when retried by RateLimitScheduler.
+    """
+    pass
+
+
 class UserStats(object):
     """
+    Counters of the user's work; there are many of them, so just slots.
     """
-    def __init__(self, login):
+    __slots__ = ("login", "reviews", "comments", "merges")
+
+    def __init__(self, login, reviews=0, comments=0, merges=0):
         self.login = login
-        self.reviews = 0
-        self.comments = 0
-        self.merges = 0
+        self.reviews = reviews
+        self.comments = comments
+        self.merges = merges
+
+    def add(self, other):
+        "Add counters of other UserStats (of the same user)."
+        self.reviews += other.reviews
+        self.comments += other.comments
+        self.merges += other.merges
+
     def pretty_print_stats(self):
         print('====================')
         print('USER: {}'.format(self.login))
@@ -29,22 +118,446 @@ class UserStats(object):
         print('====================')
 
 
+# classes of endpoints: parts of URLs which are replaced by placeholders
+_ENDPOINT_PARTS = [
+    (re.compile(r"/repos/[^/]+/[^/]+"), "/repos/:repo"),
+    (re.compile(r"/(orgs|users)/[^/]+"), r"/\1/:name"),
+    (re.compile(r"/\d+(?=/|$)"), "/:n"),
+]
+_REPO_URL_RE = re.compile(r"/repos/([^/]+/[^/]+)(?:/pulls/(\d+))?")
+
+def _endpoint(path):
+    "Return class of the endpoint of the URL path."
+    for regex, placeholder in _ENDPOINT_PARTS:
+        path = regex.sub(placeholder, path)
+    return path
+
+def _percentile(values, percent):
+    "Return the percentile of sorted values (nearest rank)."
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+class _InstrumentationHandler(logging.Handler):
+    def __init__(self, instrumentation):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self._instrumentation = instrumentation
+
+    def emit(self, record):
+        self._instrumentation._record(record)
+
+
+class Instrumentation(object):
+    """
+    Record of every request done by PyGithub, for profiling of collecting.
+
+    Requests are taken from the debug log of PyGithub's requester, which
+    has the method, URL, status, headers and content of every response.
+    The latency is the time since the start of the unit of work (see
+    RateLimitScheduler) or since the previous request of the same thread.
+    Requests are attributed to the repository and the pull request of the
+    URL, or to the repository being collected by the thread (set_repo()).
+    Retries and cache hits are counted too.
+
+    report() prints a summary of all requests. When trace_path is given,
+    every request is written to the file in the Trace Event Format (to be
+    viewed by chrome://tracing or Perfetto).
+
+    Requests are recorded between install() and close(), or inside a with
+    statement.
+    """
+
+    LOGGER = "github.Requester"
+
+    def __init__(self, trace_path=None):
+        # (start, seconds, endpoint, status, bytes, repo, pull)
+        self.requests = []
+        self.retries = 0
+        self.cache_hits = {}
+        self._start = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._handler = None
+        self._trace = None
+        self._traced = 0
+        if trace_path:
+            self._trace = open(trace_path, "w")
+            self._trace.write("[\n")
+
+    def install(self):
+        logger = logging.getLogger(self.LOGGER)
+        self._handler = _InstrumentationHandler(self)
+        self._saved_logger = (logger.level, logger.propagate)
+        logger.addHandler(self._handler)
+        logger.setLevel(logging.DEBUG)
+        # do not flood other handlers with debug messages of PyGithub
+        logger.propagate = False
+        return self
+
+    def close(self):
+        if self._handler is not None:
+            logger = logging.getLogger(self.LOGGER)
+            logger.removeHandler(self._handler)
+            level, logger.propagate = self._saved_logger
+            logger.setLevel(level)
+            self._handler = None
+        if self._trace is not None:
+            self._trace.write("\n]\n")
+            self._trace.close()
+            self._trace = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start_unit(self):
+        "Mark the start of a unit of work in the current thread."
+        self._local.mark = time.time()
+
+    def set_repo(self, repo):
+        "Attribute requests of the current thread to the repository."
+        self._local.repo = repo
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def cache_hit(self, kind):
+        with self._lock:
+            self.cache_hits[kind] = self.cache_hits.get(kind, 0) + 1
+
+    def _record(self, record):
+        # just the message logged by the requester for every response:
+        # verb, scheme, hostname, url, request headers, input, status,
+        # response headers, output
+        if not isinstance(record.args, tuple) or len(record.args) != 9:
+            return
+        verb, _, _, url, _, _, status, headers, output = record.args
+        end = record.created
+        start = getattr(self._local, "mark", None)
+        if start is None or start > end:
+            start = end
+        self._local.mark = end
+        if "content-length" in headers:
+            size = int(headers["content-length"])
+        else:
+            size = len(output) if isinstance(output, str) else 0
+        path = url.split("?", 1)[0]
+        match = _REPO_URL_RE.search(path)
+        if match:
+            repo, pull = match.group(1), match.group(2)
+            pull = int(pull) if pull else None
+        else:
+            repo, pull = getattr(self._local, "repo", None), None
+        request = (start, end - start, "{} {}".format(verb, _endpoint(path)),
+                   status, size, repo, pull)
+        with self._lock:
+            self.requests.append(request)
+            if status == 304:
+                self.cache_hits["not modified"] = self.cache_hits.get("not modified", 0) + 1
+            if self._trace is not None:
+                self._write_trace(request, record.thread)
+
+    def _write_trace(self, request, thread):
+        start, seconds, endpoint, status, size, repo, pull = request
+        event = {
+            "name": endpoint, "cat": "request", "ph": "X", "pid": 1,
+            "tid": thread, "ts": int((start - self._start) * 1e6),
+            "dur": int(seconds * 1e6),
+            "args": {"status": status, "bytes": size, "repo": repo, "pull": pull},
+        }
+        if self._traced:
+            self._trace.write(",\n")
+        json.dump(event, self._trace, sort_keys=True)
+        self._traced += 1
+
+    def report(self, out=sys.stderr, top=10, workers=None):
+        """
+        Print summary of recorded requests: totals, endpoints by the total
+        time with latency percentiles, repositories and pulls which took
+        the most time and, with the number of workers, an estimate of the
+        time which could be saved by doing requests in parallel.
+        """
+        with self._lock:
+            requests = list(self.requests)
+            retries = self.retries
+            cache_hits = dict(self.cache_hits)
+        wall = time.time() - self._start
+        busy = sum(request[1] for request in requests)
+        out.write("{} requests, {:.2f} MB, {:.1f}s spent in requests in {:.1f}s "
+                  "(parallelism {:.1f})\n".format(
+                      len(requests), sum(request[4] for request in requests) / 1e6,
+                      busy, wall, busy / wall if wall else 0))
+        out.write("retries: {}, cache hits: {}\n".format(retries, ", ".join(
+            "{} {}".format(count, kind) for kind, count in sorted(cache_hits.items())) or 0))
+
+        endpoints = {}
+        repos = {}
+        pulls = {}
+        for start, seconds, endpoint, status, size, repo, pull in requests:
+            endpoints.setdefault(endpoint, []).append((seconds, size, status))
+            if repo is not None:
+                repos[repo] = repos.get(repo, 0) + seconds
+                if pull is not None:
+                    pulls[(repo, pull)] = pulls.get((repo, pull), 0) + seconds
+
+        out.write("\n{:<45} {:>7} {:>9} {:>7} {:>7} {:>7} {:>9} {:>6}\n".format(
+            "endpoint", "count", "total s", "p50 ms", "p95 ms", "max ms", "KB", "errors"))
+        rows = []
+        for endpoint, values in endpoints.items():
+            latencies = sorted(value[0] for value in values)
+            rows.append((sum(latencies), endpoint, len(values), latencies,
+                         sum(value[1] for value in values),
+                         sum(1 for value in values if value[2] >= 400)))
+        for total, endpoint, count, latencies, size, errors in sorted(rows, reverse=True):
+            out.write("{:<45} {:>7} {:>9.2f} {:>7.0f} {:>7.0f} {:>7.0f} {:>9.0f} {:>6}\n".format(
+                endpoint, count, total, _percentile(latencies, 50) * 1e3,
+                _percentile(latencies, 95) * 1e3, latencies[-1] * 1e3, size / 1e3, errors))
+
+        if repos:
+            out.write("\nslowest repositories:\n")
+            for repo in sorted(repos, key=repos.get, reverse=True)[:top]:
+                out.write("  {:>9.2f}s {}\n".format(repos[repo], repo))
+        if pulls:
+            out.write("slowest pull requests:\n")
+            for key in sorted(pulls, key=pulls.get, reverse=True)[:top]:
+                out.write("  {:>9.2f}s {}#{}\n".format(pulls[key], *key))
+
+        if workers and busy:
+            # the requests could be spread over all workers
+            ideal = busy / workers
+            out.write("\nwith {} requests at once all the time it could take "
+                      "{:.1f}s, {:.1f}s less\n".format(workers, ideal, max(wall - ideal, 0)))
+
+
+class RateLimitScheduler(object):
+    """
+    Run units of work (functions doing API requests) within the rate limit.
+
+    The remaining quota and the time of its reset are taken from the last
+    response (the requester of PyGithub keeps them). While enough of the
+    quota remains, units are started at full speed; when less than
+    `pace_below` of the limit remains, starts of units are spread evenly
+    till the reset, and when just `reserve` requests remain, all units wait
+    for the reset. The reserve covers requests of units already running.
+
+    Failed units are retried, up to `max_attempts` times:
+     - on the primary rate limit all units wait for the reset,
+     - on a secondary rate limit all units wait for Retry-After or for an
+       exponential backoff with jitter and the next units are started with
+       a delay, which decays when units succeed,
+     - server errors (5xx) and connection errors are retried after the
+       backoff too.
+    Other errors are raised immediately; a unit failing too many times
+    raises UnitFailedError. Units and retries are recorded by the
+    instrumentation, when given.
+    """
+
+    def __init__(self, requester, reserve=50, pace_below=0.2, max_attempts=5,
+                 backoff=1.0, max_backoff=300.0, instrumentation=None):
+        self._requester = requester
+        self.instrumentation = instrumentation
+        self.reserve = reserve
+        self.pace_below = pace_below
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        # the earliest time when the next unit can be started
+        self._next_start = 0.0
+        # delay between starts of units after secondary rate limits
+        self._interval = 0.0
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run the unit of work func(*args, **kwargs) and return its result.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            if self.instrumentation is not None:
+                self.instrumentation.start_unit()
+            try:
+                result = func(*args, **kwargs)
+            except GithubException as e:
+                delay = self._reset_delay(e)
+                if delay is None:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                error = e
+            except IOError as e:
+                # connection errors and timeouts (of requests too)
+                delay = self._backoff_delay(attempt)
+                attempt += 1
+                error = e
+            else:
+                self._succeeded()
+                return result
+            if attempt >= self.max_attempts:
+                raise UnitFailedError("{} failed {} times: {}".format(
+                    getattr(func, "__name__", func), attempt, error)) from error
+            print("[WARNING] {}, retrying in {:.1f}s".format(error, delay), file=sys.stderr)
+            if self.instrumentation is not None:
+                self.instrumentation.retry()
+            self._pause(delay)
+
+    def _acquire(self):
+        "Wait till the next unit can be started."
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_start)
+            interval = self._interval
+            remaining, limit = self._requester.rate_limiting
+            reset = self._requester.rate_limiting_resettime
+            # the quota is unknown before the first response and the
+            # values are stale after the reset
+            if remaining >= 0 and reset > now:
+                if remaining <= self.reserve:
+                    start = max(start, reset + 1)
+                elif remaining < limit * self.pace_below:
+                    interval = max(interval, (reset - now) / (remaining - self.reserve))
+            self._next_start = start + interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _pause(self, delay):
+        "Do not start any unit in next delay seconds."
+        with self._lock:
+            self._next_start = max(self._next_start, time.time() + delay)
+
+    def _succeeded(self):
+        with self._lock:
+            self._interval *= 0.9
+            if self._interval < 0.01:
+                self._interval = 0.0
+
+    def _reset_delay(self, error):
+        "Return seconds till the reset of the exhausted primary rate limit."
+        headers = error.headers or {}
+        if error.status not in (403, 429) or headers.get("x-ratelimit-remaining") != "0":
+            return None
+        reset = float(headers.get("x-ratelimit-reset", 0))
+        return max(reset - time.time(), 0) + 1
+
+    def _retry_delay(self, error, attempt):
+        "Return seconds to wait before retrying or None to not retry."
+        headers = error.headers or {}
+        if isinstance(error, RateLimitExceededException) or error.status == 429:
+            # secondary rate limit: slow down all units
+            with self._lock:
+                self._interval = min(max(self._interval * 2, 0.1), 5.0)
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+            return self._backoff_delay(attempt)
+        if error.status >= 500:
+            return self._backoff_delay(attempt)
+        return None
+
+    def _backoff_delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+
 class GithubPullStats(object):
     """
+    Reviewers, commentators and merger of the pull request.
+
+    Reviewers and commentators are dicts login -> time of the first review
+    or comment of the user.
+
+    When executor is given, reviews, comments and merger are requested by
+    its threads and the constructor returns immediately; the getters wait
+    for the data. Otherwise everything is fetched by the constructor.
+    Every request is a unit of work of the scheduler, when given.
     """
 
-    def __init__(self, pull):
+    def __init__(self, pull, executor=None, scheduler=None):
         self._pull = pull
-        print("[INFO] Init pull: {}".format(pull))
-        print("[INFO] Get reviews: {}".format(pull))
-        self._reviews =  [review for review in self._pull.get_reviews()]
-        print("[INFO] Get comments: {}".format(pull))
-        self._comments = [comment for comment in self._pull.get_comments()]
+        self._scheduler = scheduler
+        print("[INFO] Init pull: {}".format(pull), file=sys.stderr)
+        self.number = self._pull.number
+        self.updated_at = _timestamp(self._pull.updated_at)
+        self.merged_at = self._at(self._pull.merged_at)
         self.author = self._pull.user.login
-        print("[INFO] Setup rws: {}".format(pull))
-        self.reviewers = set([review.user for review in self._reviews])
-        print("[INFO] Setup commentators: {}".format(pull))
-        self.commentators = set([comm.user for comm in self._comments])
+        if executor is None:
+            self._reviews = self._call(self._fetch_reviewers)
+            self._comments = self._call(self._fetch_commentators)
+            self._merged_by = self._call(self._fetch_merged_by)
+        else:
+            self._reviews = executor.submit(self._call, self._fetch_reviewers)
+            self._comments = executor.submit(self._call, self._fetch_commentators)
+            self._merged_by = executor.submit(self._call, self._fetch_merged_by)
+
+    def _call(self, func):
+        if self._scheduler is None:
+            return func()
+        return self._scheduler.call(func)
+
+    def _at(self, value):
+        # pending reviews have no time
+        if value is None:
+            return self.updated_at
+        return _timestamp(value)
+
+    def _fetch_reviewers(self):
+        print("[INFO] Get reviews: {}".format(self._pull), file=sys.stderr)
+        return _first_times((review.user.login, self._at(review.submitted_at))
+                            for review in self._pull.get_reviews())
+
+    def _fetch_commentators(self):
+        print("[INFO] Get comments: {}".format(self._pull), file=sys.stderr)
+        return _first_times((comm.user.login, self._at(comm.created_at))
+                            for comm in self._pull.get_comments())
+
+    def _fetch_merged_by(self):
+        # merged_at is part of the listing, so just merged pull requests
+        # need to be completed to get the merger
+        if self._pull.merged_at is None:
+            return None
+        return self._pull.merged_by.login
+
+    @classmethod
+    def from_data(cls, number, updated_at, author, reviewers, commentators,
+                  merged_by, merged_at):
+        """
+        Create the object from already fetched data, without any request.
+        """
+        self = cls.__new__(cls)
+        self._pull = None
+        self._scheduler = None
+        self.number = number
+        self.updated_at = updated_at
+        self.merged_at = merged_at
+        self.author = author
+        self._reviews = reviewers
+        self._comments = commentators
+        self._merged_by = merged_by
+        return self
+
+    def cancel(self):
+        """
+        Cancel requests which have not been started yet.
+        """
+        for value in (self._reviews, self._comments, self._merged_by):
+            if hasattr(value, "cancel"):
+                value.cancel()
+
+    @staticmethod
+    def _result(value):
+        if hasattr(value, "result"):
+            return value.result()
+        return value
+
+    @property
+    def reviewers(self):
+        return self._result(self._reviews)
+
+    @property
+    def commentators(self):
+        return self._result(self._comments)
 
     def get_reviewers(self):
         return self.reviewers
@@ -53,68 +566,590 @@ class GithubPullStats(object):
         return self.commentators
 
     def is_merged(self):
-        return self._pull.is_merged()
+        return self.merged_by() is not None
 
     def merged_by(self):
-        if self.is_merged():
-            return self._pull.merged_by.login
-        return None
+        return self._result(self._merged_by)
+
+
+def _timestamp(value):
+    "Return datetime as a string which can be compared and stored."
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _login(actor):
+    "Return login of the GraphQL actor; deleted users are 'ghost' as in REST."
+    if actor is None:
+        return "ghost"
+    return actor["login"]
+
+def _first_times(items):
+    "Return dict login -> the earliest time of (login, time) items."
+    times = {}
+    for login, at in items:
+        if login not in times or at < times[login]:
+            times[login] = at
+    return times
+
+
+def _merge_users(users, other):
+    "Add UserStats of dict other to dict users (login -> UserStats)."
+    for login, stats in other.items():
+        if login in users:
+            users[login].add(stats)
+        else:
+            users[login] = UserStats(login, stats.reviews, stats.comments, stats.merges)
+
+
+class StatsAggregator(object):
+    """
+    Counters of users' work updated by a stream of pull requests.
+
+    Every pull request is counted once and can be thrown away; just
+    UserStats are kept, in dicts login -> UserStats:
+     - users: totals,
+     - by_repo[repo]: per repository,
+     - by_period[period]: per time period (see WINDOWS) of every review,
+       comment and merge, when window is given.
+    All of them are computed in a single pass.
+
+    Aggregators can be merged (in any order and grouping), e.g. results of
+    repositories collected in parallel or saved by separate runs.
+    """
+
+    FIELDS = ("reviews", "comments", "merges")
+
+    def __init__(self, window=None):
+        if window is not None and window not in WINDOWS:
+            raise ValueError("Unknown window: {}".format(window))
+        self.window = window
+        self.users = {}
+        self.by_repo = {}
+        self.by_period = {}
+
+    def _tables(self, repo_users, at):
+        if self.window is None:
+            return (self.users, repo_users)
+        period = WINDOWS[self.window](at)
+        if period not in self.by_period:
+            self.by_period[period] = {}
+        return (self.users, repo_users, self.by_period[period])
+
+    @staticmethod
+    def _user(users, login):
+        stats = users.get(login)
+        if stats is None:
+            stats = users[login] = UserStats(login)
+        return stats
+
+    def add_pull(self, repo, pull):
+        """
+        Count the pull (GithubPullStats) of the repository.
+
+        Nothing is counted when data of the pull cannot be obtained.
+        """
+        reviewers = pull.get_reviewers()
+        commentators = pull.get_commentators()
+        merged_by = pull.merged_by()
+        repo_users = self.by_repo.setdefault(repo, {})
+        for login, at in reviewers.items():
+            for users in self._tables(repo_users, at):
+                self._user(users, login).reviews += 1
+        for login, at in commentators.items():
+            for users in self._tables(repo_users, at):
+                self._user(users, login).comments += 1
+        if merged_by:
+            for users in self._tables(repo_users, pull.merged_at):
+                self._user(users, merged_by).merges += 1
+
+    def merge(self, other):
+        """
+        Add counters of other aggregator (of the same window), return self.
+        """
+        if other.window != self.window:
+            raise ValueError("Cannot merge statistics of windows {} and {}".format(
+                self.window, other.window))
+        _merge_users(self.users, other.users)
+        for repo, users in other.by_repo.items():
+            _merge_users(self.by_repo.setdefault(repo, {}), users)
+        for period, users in other.by_period.items():
+            _merge_users(self.by_period.setdefault(period, {}), users)
+        return self
+
+    def to_dict(self):
+        """
+        Return the statistics as a dict which can be saved as JSON.
+        """
+        def table(users):
+            return {login: {field: getattr(stats, field) for field in self.FIELDS}
+                    for login, stats in users.items()}
+        return {
+            "window": self.window,
+            "users": table(self.users),
+            "repos": {repo: table(users) for repo, users in self.by_repo.items()},
+            "periods": {period: table(users) for period, users in self.by_period.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create the aggregator from the result of to_dict().
+        """
+        def table(counters):
+            return {login: UserStats(login, **values) for login, values in counters.items()}
+        self = cls(data["window"])
+        self.users = table(data["users"])
+        self.by_repo = {repo: table(users) for repo, users in data["repos"].items()}
+        self.by_period = {period: table(users) for period, users in data["periods"].items()}
+        return self
+
+    def write_json(self, fp):
+        json.dump(self.to_dict(), fp, indent=2, sort_keys=True)
+
+    def write_csv(self, fp):
+        """
+        Write rows (scope, name, login, reviews, comments, merges), where
+        scope is "total", "repo" or "period" and name is the repository or
+        the period.
+        """
+        writer = csv.writer(fp)
+        writer.writerow(("scope", "name", "login") + self.FIELDS)
+        tables = [("total", "", self.users)]
+        tables += [("repo", repo, self.by_repo[repo]) for repo in sorted(self.by_repo)]
+        tables += [("period", period, self.by_period[period]) for period in sorted(self.by_period)]
+        for scope, name, users in tables:
+            for login in sorted(users):
+                stats = users[login]
+                writer.writerow((scope, name, login) + tuple(
+                    getattr(stats, field) for field in self.FIELDS))
+
+
+class StatsCache(object):
+    """
+    Persistent storage of pull requests' data (SQLite database).
+
+    Reviewers, commentators and merger of every pull request are stored
+    together with its updated_at time, so just pull requests updated since
+    the last synchronisation of the repository have to be fetched again.
+    The newest updated_at and validators (ETag, Last-Modified) of the
+    listing are stored per repository too, so an unchanged repository costs
+    a single conditional request.
+
+    The database is recreated when its schema version differs; the data
+    are just fetched again.
+    """
+
+    _SCHEMA_VERSION = 2
+    _TABLES = ("repos", "pulls", "participants")
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS repos (
+            repo TEXT PRIMARY KEY,
+            updated_at TEXT,
+            etag TEXT,
+            last_modified TEXT
+        );
+        CREATE TABLE IF NOT EXISTS pulls (
+            repo TEXT,
+            number INTEGER,
+            updated_at TEXT,
+            author TEXT,
+            merged_by TEXT,
+            merged_at TEXT,
+            PRIMARY KEY (repo, number)
+        );
+        CREATE TABLE IF NOT EXISTS participants (
+            repo TEXT,
+            number INTEGER,
+            role TEXT,
+            login TEXT,
+            at TEXT,
+            PRIMARY KEY (repo, number, role, login)
+        );
+    """
+
+    REVIEWER = "review"
+    COMMENTATOR = "comment"
+
+    # stored pulls are committed in batches, so an interrupted scan loses
+    # at most this number of pulls
+    COMMIT_EVERY = 50
+
+    # number of pulls read at once by iter_pulls()
+    READ_BATCH = 500
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        with self._lock:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version != self._SCHEMA_VERSION:
+                for table in self._TABLES:
+                    self._db.execute("DROP TABLE IF EXISTS {}".format(table))
+                self._db.execute("PRAGMA user_version = {}".format(self._SCHEMA_VERSION))
+            self._db.executescript(self._SCHEMA)
+
+    def get_sync(self, repo):
+        """
+        Return (updated_at, etag, last_modified) of the last complete
+        synchronisation of the repository (Nones if there was none).
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT updated_at, etag, last_modified FROM repos WHERE repo = ?",
+                (repo,)).fetchone()
+        return row or (None, None, None)
+
+    def set_sync(self, repo, updated_at, etag=None, last_modified=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?)",
+                (repo, updated_at, etag, last_modified))
+
+    def get_updated(self, repo):
+        """
+        Return dict pull number -> updated_at of stored pulls.
+        """
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT number, updated_at FROM pulls WHERE repo = ?", (repo,)))
+
+    def iter_pulls(self, repo, exclude=()):
+        """
+        Yield GithubPullStats of stored pulls, except the excluded numbers.
+
+        Pulls are read in batches, so the memory does not depend on the
+        number of pulls and pulls can be stored in the meantime.
+        """
+        last = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT number, updated_at, author, merged_by, merged_at FROM pulls"
+                    " WHERE repo = ? AND number > ? ORDER BY number LIMIT ?",
+                    (repo, last, self.READ_BATCH)).fetchall()
+                if not rows:
+                    return
+                participants = self._db.execute(
+                    "SELECT number, role, login, at FROM participants"
+                    " WHERE repo = ? AND number BETWEEN ? AND ?",
+                    (repo, rows[0][0], rows[-1][0])).fetchall()
+            times = {}
+            for number, role, login, at in participants:
+                times.setdefault((number, role), {})[login] = at
+            for number, updated_at, author, merged_by, merged_at in rows:
+                if number in exclude:
+                    continue
+                yield GithubPullStats.from_data(
+                    number, updated_at, author,
+                    times.get((number, self.REVIEWER), {}),
+                    times.get((number, self.COMMENTATOR), {}),
+                    merged_by, merged_at)
+            last = rows[-1][0]
+
+    def store_pull(self, repo, pull):
+        """
+        Store data of the pull (GithubPullStats), replacing the old ones.
+        """
+        participants = [(repo, pull.number, self.REVIEWER, login, at)
+                        for login, at in pull.get_reviewers().items()]
+        participants += [(repo, pull.number, self.COMMENTATOR, login, at)
+                         for login, at in pull.get_commentators().items()]
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pulls VALUES (?, ?, ?, ?, ?, ?)",
+                (repo, pull.number, pull.updated_at, pull.author, pull.merged_by(),
+                 pull.merged_at))
+            self._db.execute(
+                "DELETE FROM participants WHERE repo = ? AND number = ?",
+                (repo, pull.number))
+            self._db.executemany(
+                "INSERT INTO participants VALUES (?, ?, ?, ?, ?)", participants)
+            self._uncommitted += 1
+            if self._uncommitted >= self.COMMIT_EVERY:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def clear(self, repo=None):
+        """
+        Remove stored data of the repository or of all repositories.
+        """
+        with self._lock:
+            for table in self._TABLES:
+                if repo is None:
+                    self._db.execute("DELETE FROM {}".format(table))
+                else:
+                    self._db.execute(
+                        "DELETE FROM {} WHERE repo = ?".format(table), (repo,))
+            self._db.commit()
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
 
 
 class GithubRepoStats(object):
     """
-    TODO
+    Statistics of users' work on pull requests of the repository.
+
+    Requests of pull requests are done by at most `workers` threads; the
+    listing is paged lazily, so the threads start working on the first
+    pull requests while next pages are being fetched. Results do not depend
+    on the order in which requests finish.
+
+    With BACKEND_GRAPHQL, pages of pull requests are fetched together with
+    their reviews, review comments and merger by GraphQL queries, so there
+    are no requests per pull request. The statistics are the same.
+
+    All requests go through the RateLimitScheduler. Pulls which failed even
+    when retried are not counted; with the cache, the next run fetches just
+    them and pulls not stored yet, so an interrupted scan is resumed.
+
+    Pulls are counted by the StatsAggregator as they come and thrown away;
+    just a few pulls per worker are being fetched at once, so the memory
+    does not grow with the number of pulls. Statistics of the repository
+    are in `users` (dict login -> UserStats).
     """
 
-    def _get_pulls(self):
-        return {pr.number:GithubPullStats(pr) for pr in self._repo.get_pulls(state='all')}
+    # pulls being fetched at once per worker
+    PENDING_PER_WORKER = 4
+
+    def _iter_pulls(self, executor):
+        """
+        Yield GithubPullStats of all pulls of the repository.
+        """
+        # numbers of listed pulls; pulls updated during the listing move to
+        # its start, so the next page repeats a pull of the previous one
+        seen = set()
+        if self._cache is None:
+            # updates do not change this order, nothing is skipped
+            for number, _, make_stats in self._list_pulls(executor, by_update=False):
+                if number not in seen:
+                    seen.add(number)
+                    yield make_stats()
+            return
+
+        stored = self._cache.get_updated(self._name)
+        synced, etag, last_modified = self._cache.get_sync(self._name)
+        headers = self._check_pulls_modified(etag, last_modified)
+        if headers is None:
+            print("[INFO] Pulls not modified GHRS: {}".format(self._repo), file=sys.stderr)
+        else:
+            self._newest = synced
+            # the most recently updated pulls go first, so the listing can be
+            # stopped when pulls older than the last synchronisation come
+            for pull in self._fetch_listed(executor, synced, seen, stored):
+                yield pull
+            started = self._newest
+            if self._listed_pages > 1:
+                # pulls updated while next pages were listed are in front of
+                # the pages read already, list them again
+                for pull in self._fetch_listed(executor, started, seen, stored):
+                    yield pull
+            self._sync = (self._newest, headers.get("etag"), headers.get("last-modified"))
+        del stored
+        instrumentation = self._scheduler.instrumentation
+        for pull in self._cache.iter_pulls(self._name, exclude=self._fetched):
+            if instrumentation is not None:
+                instrumentation.cache_hit("pulls")
+            yield pull
+
+    def _fetch_listed(self, executor, since, seen, stored):
+        """
+        Yield GithubPullStats of pulls updated since the time (all when it
+        is None), which are not seen yet nor stored with the same update.
+        """
+        for number, updated_at, make_stats in self._list_pulls(executor):
+            if self._newest is None or updated_at > self._newest:
+                self._newest = updated_at
+            if since is not None and updated_at < since:
+                break
+            if number in seen:
+                continue
+            seen.add(number)
+            if stored.get(number) == updated_at:
+                continue
+            self._fetched.add(number)
+            yield make_stats()
+
+    def _list_pulls(self, executor, by_update=True):
+        """
+        Yield (number, updated_at, make_stats) of pulls, the most recently
+        updated first, or the oldest created first when by_update is False;
+        make_stats() returns GithubPullStats of the pull.
+
+        Pages are fetched lazily, so just pulls which are really needed are
+        requested; _listed_pages is the number of pages requested so far.
+        """
+        self._listed_pages = 0
+        if self._backend == BACKEND_GRAPHQL:
+            for item in self._list_pulls_graphql(executor, by_update):
+                yield item
+            return
+        # pages are units of work, so a failed page is retried alone
+        if by_update:
+            listing = self._repo.get_pulls(state='all', sort='updated', direction='desc')
+        else:
+            listing = self._repo.get_pulls(state='all', sort='created', direction='asc')
+        per_page = self._repo.requester.per_page
+        page = 0
+        while True:
+            prs = self._scheduler.call(listing.get_page, page)
+            self._listed_pages += 1
+            for pr in prs:
+                yield pr.number, _timestamp(pr.updated_at), partial(GithubPullStats, pr, executor, self._scheduler)
+            if len(prs) < per_page:
+                break
+            page += 1
+
+    def _list_pulls_graphql(self, executor, by_update):
+        owner, name = self._name.split("/", 1)
+        if by_update:
+            order = {"field": "UPDATED_AT", "direction": "DESC"}
+        else:
+            order = {"field": "CREATED_AT", "direction": "ASC"}
+        variables = dict(GRAPHQL_PAGE_SIZES, owner=owner, name=name, cursor=None, order=order)
+        while True:
+            print("[INFO] GraphQL query GHRS: {} after {}".format(self._repo, variables["cursor"]), file=sys.stderr)
+            _, data = self._scheduler.call(self._repo.requester.graphql_query, _PULLS_QUERY, variables)
+            self._listed_pages += 1
+            connection = data["data"]["repository"]["pullRequests"]
+            for node in connection["nodes"]:
+                yield node["number"], node["updatedAt"], partial(self._graphql_pull_stats, node, executor)
+            if not connection["pageInfo"]["hasNextPage"]:
+                break
+            variables["cursor"] = connection["pageInfo"]["endCursor"]
+
+    def _graphql_pull_stats(self, node, executor):
+        reviews = node["reviews"]
+        truncated = reviews["pageInfo"]["hasNextPage"] or any(
+            review["comments"]["pageInfo"]["hasNextPage"] for review in reviews["nodes"])
+        if truncated:
+            print("[INFO] Too many reviews for GraphQL, using REST: {}".format(node["number"]), file=sys.stderr)
+            pr = self._scheduler.call(self._repo.get_pull, node["number"])
+            return GithubPullStats(pr, executor, self._scheduler)
+        merged_by = node["mergedBy"]
+        updated_at = node["updatedAt"]
+        return GithubPullStats.from_data(
+            node["number"], updated_at, _login(node["author"]),
+            _first_times((_login(review["author"]), review["submittedAt"] or updated_at)
+                         for review in reviews["nodes"]),
+            _first_times((_login(comm["author"]), comm["createdAt"] or updated_at)
+                         for review in reviews["nodes"]
+                         for comm in review["comments"]["nodes"]),
+            merged_by["login"] if merged_by else None,
+            node["mergedAt"])
+
+    def _check_pulls_modified(self, etag, last_modified):
+        """
+        Return headers of the first page of the listing by the last update
+        or None when nothing has been changed since the last synchronisation.
+
+        Any change of any pull request moves it to the first place of the
+        listing, so the validators of the single item page are enough.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        parameters = {"state": "all", "sort": "updated", "direction": "desc", "per_page": 1}
+        resp_headers, data = self._scheduler.call(
+            self._repo.requester.requestJsonAndCheck,
+            "GET", self._repo.url + "/pulls", parameters=parameters, headers=headers)
+        if data is None:
+            # 304 Not Modified has no content
+            return None
+        return resp_headers
 
     def _get_issues(self):
         raise NotImplemented("This has not been implemented yet..")
 
-    def _calc_users_stats(self):
-        users = {}
+    def _calc_users_stats(self, executor):
         timeout_counter = 0
+        # pulls being fetched, they are counted in the order of the listing
+        pending = deque()
+        max_pending = self._workers * self.PENDING_PER_WORKER
 
         def __calculation(pull):
-            for user in pull.get_reviewers():
-                username = user.login
-                if username not in users:
-                    users[username] = UserStats(username)
-                users[username].reviews += 1
-            for user in pull.get_commentators():
-                username = user.login
-                if username not in users:
-                    users[username] = UserStats(username)
-                users[username].comments += 1
-            username = pull.merged_by()
-            if username:
-                if username not in users:
-                    users[username] = UserStats(username)
-                users[username].merges += 1
+            try:
+                print("[INFO] Calculation pull: {}".format(pull.number), file=sys.stderr)
+                self.stats.add_pull(self._name, pull)
+                if pull.number in self._fetched:
+                    self._cache.store_pull(self._name, pull)
+            except (socket.timeout, UnitFailedError) as e:
+                print("[ERROR] Pull {} failed: {}".format(pull.number, e), file=sys.stderr)
+                self._complete = False
+                return False
+            return True
 
         try:
-            for pull_number,pull in self._pulls.items():
-                try:
-                    print("[INFO] Calculation pull: {}".format(pull_number), file=sys.stderr)
-                    __calculation(pull)
-                except socket.timeout as e:
-                    print("[ERROR] Socket nested timeout hit: {}".format(e), file=sys.stderr)
-                    if timeout_counter >= 3:
-                        break
-                    timeout_counter += 1
-        except socket.timeout as e:
-            print("[ERROR] Socket timeout hit: {}".format(e), file=sys.stderr)
-        return users
-
-
-    def __init__(self, repo):
+            try:
+                for pull in self._iter_pulls(executor):
+                    pending.append(pull)
+                    if len(pending) > max_pending and not __calculation(pending.popleft()):
+                        if timeout_counter >= 3:
+                            return
+                        timeout_counter += 1
+                while pending:
+                    if not __calculation(pending.popleft()):
+                        if timeout_counter >= 3:
+                            return
+                        timeout_counter += 1
+            except socket.timeout as e:
+                print("[ERROR] Socket timeout hit: {}".format(e), file=sys.stderr)
+                self._complete = False
+        finally:
+            # do not wait for requests nobody is interested in anymore
+            for pull in pending:
+                pull.cancel()
+
+
+    def __init__(self, repo, workers=DEFAULT_WORKERS, cache=None,
+                 backend=BACKEND_REST, scheduler=None, aggregator=None):
         print("[INFO] initialisation GHRS: {}".format(repo), file=sys.stderr)
+        if backend not in _BACKENDS:
+            raise ValueError("Unknown backend: {}".format(backend))
         self._repo = repo
-        print("[INFO] Getting pulls GHRS: {}".format(repo), file=sys.stderr)
-        self._pulls = self._get_pulls()
-        print("[INFO] Calculation begins GHRS: {}".format(repo), file=sys.stderr)
-        self.users = self._calc_users_stats()
+        self._backend = backend
+        if scheduler is None:
+            scheduler = RateLimitScheduler(repo.requester)
+        self._scheduler = scheduler
+        self._name = repo.full_name
+        self._cache = cache
+        self._workers = workers
+        # numbers of pulls fetched from the API (not loaded from the cache)
+        self._fetched = set()
+        self._sync = None
+        # the newest update of listed pulls and number of listed pages
+        self._newest = None
+        self._listed_pages = 0
+        self._complete = True
+        self.stats = aggregator if aggregator is not None else StatsAggregator()
+        instrumentation = self._scheduler.instrumentation
+        if instrumentation is not None:
+            instrumentation.set_repo(self._name)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            print("[INFO] Calculation begins GHRS: {}".format(repo), file=sys.stderr)
+            try:
+                self._calc_users_stats(executor)
+            finally:
+                if instrumentation is not None:
+                    instrumentation.set_repo(None)
+                if self._cache is not None:
+                    # pulls which failed are fetched by the next run
+                    if self._complete and self._sync is not None:
+                        self._cache.set_sync(self._name, *self._sync)
+                    self._cache.commit()
+        self.users = self.stats.by_repo.get(self._name, {})
 
 
 class GithubStats(object):
@@ -124,44 +1159,200 @@ class GithubStats(object):
     Just a class to be able to collect some additional information about the
     authenticated user or about events in repositories to which user has
     access.
+
+    Repositories and organizations are fetched when needed. Repositories
+    are collected by `repo_workers` threads at once, each of them by
+    `workers` threads; results of all collected repositories are merged in
+    `stats` (StatsAggregator). Requests are recorded by the instrumentation,
+    when given.
     """
 
-    def __init__(self, access_token=None):
+    def __init__(self, access_token=None, base_url=None, workers=DEFAULT_WORKERS,
+                 cache_path=None, backend=BACKEND_REST, window=None,
+                 repo_workers=DEFAULT_REPO_WORKERS, instrumentation=None):
         if not access_token:
             raise ValueError("The access_token must be specified.")
-        self.client = Github(login_or_token=GH_TOKEN)
+        kwargs = {}
+        if base_url:
+            kwargs["base_url"] = base_url
+        # the connection pool has to be big enough for all threads; the
+        # requests are not delayed nor retried by the client itself, it is
+        # the job of the scheduler
+        self.client = Github(login_or_token=access_token, per_page=100,
+                             pool_size=workers * repo_workers,
+                             seconds_between_requests=None, retry=None, **kwargs)
+        self.scheduler = RateLimitScheduler(self.client.requester,
+                                            instrumentation=instrumentation)
+        self.workers = workers
+        self.repo_workers = repo_workers
+        self.backend = backend
+        self.window = window
+        self.cache = StatsCache(cache_path) if cache_path else None
         self._user = self.client.get_user()
-        if self._user.login is None:
+        if self.scheduler.call(lambda: self._user.login) is None:
             raise AuthenticationError("Cannot authenticate to the Github.")
-        self._repos = {repo.full_name:repo for repo in self.client.get_user().get_repos()}
-        self._orgs = {org.login:org for org in self._user.get_orgs()}
+        self._load()
+
+    def _load(self):
+        self._repos = None
+        self._orgs = None
+        self._org_repos = {}
+        self._repo_stats = {}
+        # statistics of all collected repositories
+        self.stats = StatsAggregator(self.window)
 
-    def reload(self):
+    def reload(self, full=False):
         """
         Reload all cached data.
+
+        Repositories and organizations are fetched again and statistics of
+        repositories are computed again when requested. Pulls stored in the
+        persistent cache are refreshed incrementally, unless full is True,
+        in that case the cache is cleared and everything is fetched again.
         """
-        raise NotImplemented("This has not been implemented yet..")
+        if full and self.cache is not None:
+            self.cache.clear()
+        self._load()
+
+    def _collect_repo(self, repo):
+        return GithubRepoStats(repo, self.workers, self.cache, self.backend,
+                               self.scheduler, StatsAggregator(self.window))
+
+    def get_repo_stats(self, repo):
+        """
+        Return GithubRepoStats of the repository (computed just once).
+        """
+        if repo.full_name not in self._repo_stats:
+            repo_stats = self._collect_repo(repo)
+            self._repo_stats[repo.full_name] = repo_stats
+            self.stats.merge(repo_stats.stats)
+        return self._repo_stats[repo.full_name]
+
+    def collect_repos(self, repos):
+        """
+        Collect statistics of the repositories in parallel.
+
+        Every repository is counted into its own StatsAggregator; they are
+        merged into `stats` in the given order, so the results do not depend
+        on which repository is finished first. Return dict full name ->
+        GithubRepoStats; repositories which failed are reported and left
+        out, they can be collected by another call.
+        """
+        todo = [repo for repo in repos if repo.full_name not in self._repo_stats]
+        with ThreadPoolExecutor(max_workers=self.repo_workers) as executor:
+            futures = [(repo, executor.submit(self._collect_repo, repo)) for repo in todo]
+            for repo, future in futures:
+                try:
+                    repo_stats = future.result()
+                except (UnitFailedError, GithubException, IOError) as e:
+                    print("[ERROR] Repository {} failed: {}".format(repo.full_name, e), file=sys.stderr)
+                    continue
+                self._repo_stats[repo.full_name] = repo_stats
+                self.stats.merge(repo_stats.stats)
+        return {repo.full_name:self._repo_stats[repo.full_name]
+                for repo in repos if repo.full_name in self._repo_stats}
 
     def get_repos(self):
+        if self._repos is None:
+            self._repos = self.scheduler.call(
+                lambda: {repo.full_name:repo for repo in self._user.get_repos()})
         return self._repos
 
     # TODO: think just about list of strings and work all the time with repos
     # # # # only
     def get_orgs(self):
+        if self._orgs is None:
+            self._orgs = self.scheduler.call(
+                lambda: {org.login:org for org in self._user.get_orgs()})
         return self._orgs
 
+    def get_org(self, org_name):
+        if self._orgs is not None and org_name in self._orgs:
+            return self._orgs[org_name]
+        return self.scheduler.call(self.client.get_organization, org_name)
+
     def get_org_repos(self, org_name):
-        return {repo.name:repo for repo in self.get_orgs()[org_name].get_repos()}
+        if org_name not in self._org_repos:
+            org = self.get_org(org_name)
+            self._org_repos[org_name] = self.scheduler.call(
+                lambda: {repo.name:repo for repo in org.get_repos()})
+        return self._org_repos[org_name]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Collect statistics of users' work on pull requests of "
+                    "repositories of GitHub organizations.")
+    parser.add_argument("orgs", nargs="+", metavar="ORG",
+                        help="organizations to collect")
+    parser.add_argument("-r", "--repo", action="append",
+                        help="collect just given repositories (names)")
+    parser.add_argument("--token", default=os.environ.get("GH_TOKEN", GH_TOKEN),
+                        help="access token (default: $GH_TOKEN)")
+    parser.add_argument("--base-url", help="URL of the API (default: GitHub)")
+    parser.add_argument("-b", "--backend", choices=_BACKENDS,
+                        default=BACKEND_REST, help="API used to collect pulls")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help="threads fetching pulls of a repository")
+    parser.add_argument("-J", "--repo-workers", type=int,
+                        default=DEFAULT_REPO_WORKERS,
+                        help="repositories collected at once")
+    parser.add_argument("--cache", default=CACHE_PATH,
+                        help="file with already fetched data (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="fetch everything, do not store anything")
+    parser.add_argument("-w", "--window", choices=sorted(WINDOWS),
+                        help="count also per time periods")
+    parser.add_argument("-o", "--output",
+                        help="write results as JSON (or CSV if the file name "
+                             "ends with .csv) instead of printing them")
+    parser.add_argument("--merge", action="append", metavar="JSON",
+                        help="add results saved before (e.g. by other runs)")
+    parser.add_argument("--profile", action="store_true",
+                        help="print summary of all requests at the end")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write every request to the file (Trace Event "
+                             "Format, see chrome://tracing)")
+    args = parser.parse_args(argv)
 
+    instrumentation = None
+    if args.profile or args.trace:
+        instrumentation = Instrumentation(args.trace).install()
+    try:
+        gstat = GithubStats(access_token=args.token, base_url=args.base_url,
+                            workers=args.workers, repo_workers=args.repo_workers,
+                            cache_path=None if args.no_cache else args.cache,
+                            backend=args.backend, window=args.window,
+                            instrumentation=instrumentation)
+        repos = []
+        for org_name in args.orgs:
+            org_repos = gstat.get_org_repos(org_name)
+            repos.extend(org_repos[name] for name in sorted(org_repos)
+                         if not args.repo or name in args.repo)
+        repostats = gstat.collect_repos(repos)
+    finally:
+        if instrumentation is not None:
+            instrumentation.close()
+            if args.profile:
+                instrumentation.report(workers=args.workers * args.repo_workers)
+    for path in args.merge or []:
+        with open(path) as fp:
+            gstat.stats.merge(StatsAggregator.from_dict(json.load(fp)))
 
-gstat = GithubStats(access_token=GH_TOKEN)
-oamg_repos = gstat.get_org_repos('<org-repos>')
-repostats = {}
-for reponame,repo in oamg_repos.items():
-    repostats[reponame] = GithubRepoStats(repo)
+    if args.output:
+        with open(args.output, "w", newline="") as fp:
+            if args.output.endswith(".csv"):
+                gstat.stats.write_csv(fp)
+            else:
+                gstat.stats.write_json(fp)
+    else:
+        for st in repostats.values():
+            print("#######################################")
+            for user in st.users.values():
+                user.pretty_print_stats()
+    # failed repositories are reported already
+    return 0 if len(repostats) == len(repos) else 1
 
-for st in repostats.values():
-    print("#######################################")
-    for user in st.users:
-        user.pretty_print_stats()
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,758 @@
+#!/usr/bin/python3
+
+"""
+Fake GitHub API serving generated pull requests and checks of githubstats
+against it.
+
+The server answers requests which githubstats does - listings of
+repositories and pull requests (paged, with ETags), pull requests, their
+reviews, review comments and mergers, and the GraphQL query of pages of
+pull requests with all of that - from FakeData, so the statistics
+githubstats should compute are known. It can simulate the primary rate
+limit (with its headers), secondary rate limits and server errors.
+Checks collect the statistics in various ways and compare them with
+the expected ones:
+
+    ./githubstatsStub.py                # run all checks
+    ./githubstatsStub.py backends       # run just the given checks
+    ./githubstatsStub.py --serve        # just the server, e.g. for
+    ./githubstats.py --token x --no-cache --base-url http://127.0.0.1:PORT org
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from github import GithubException, RateLimitExceededException
+
+import githubstats
+
+
+def _first_times(items):
+    "Return dict login -> the earliest time of (login, time) items."
+    times = {}
+    for login, at in items:
+        if login not in times or at < times[login]:
+            times[login] = at
+    return times
+
+
+class FakeData(object):
+    """
+    Organization with repositories of generated pull requests.
+
+    `repos` is a dict name -> list of pull requests; pull request is a dict
+    with keys number, user, updated_at, merged_by, merged_at and reviews,
+    a list of (login, submitted_at, comments) where comments is a list of
+    (login, created_at). Pending reviews have no submitted_at. The same
+    seed generates the same data.
+    """
+
+    USERS = ["user{}".format(i) for i in range(8)]
+
+    def __init__(self, org="org", repos=2, pulls=40, seed=0):
+        rnd = random.Random(seed)
+        self.org = org
+        self.repos = {}
+        for i in range(repos):
+            self.repos["repo{}".format(i)] = [
+                self._pull(rnd, number) for number in range(1, pulls + 1)]
+
+    def _pull(self, rnd, number):
+        def at():
+            return "20{:02d}-{:02d}-{:02d}T{:02d}:00:00Z".format(
+                rnd.randint(22, 24), rnd.randint(1, 12), rnd.randint(1, 28),
+                rnd.randint(0, 23))
+        merged = rnd.random() < 0.5
+        reviews = []
+        for _ in range(rnd.randint(0, 4)):
+            comments = [(rnd.choice(self.USERS), at())
+                        for _ in range(rnd.randint(0, 12))]
+            submitted_at = at() if rnd.random() < 0.95 else None
+            reviews.append((rnd.choice(self.USERS), submitted_at, comments))
+        return {
+            "number": number,
+            "user": rnd.choice(self.USERS),
+            "updated_at": at(),
+            "merged_by": rnd.choice(self.USERS) if merged else None,
+            "merged_at": at() if merged else None,
+            "reviews": reviews,
+        }
+
+    def full_name(self, repo):
+        return "{}/{}".format(self.org, repo)
+
+    def expected(self, window=None):
+        """
+        Return statistics of all repositories in the form of
+        StatsAggregator.to_dict().
+        """
+        result = {"window": window, "users": {}, "repos": {}, "periods": {}}
+
+        def count(repo_users, login, at, field):
+            tables = [result["users"], repo_users]
+            if window is not None:
+                period = githubstats.WINDOWS[window](at)
+                tables.append(result["periods"].setdefault(period, {}))
+            for users in tables:
+                counters = users.setdefault(
+                    login, dict.fromkeys(githubstats.StatsAggregator.FIELDS, 0))
+                counters[field] += 1
+
+        for repo, pulls in self.repos.items():
+            if not pulls:
+                continue
+            repo_users = result["repos"].setdefault(self.full_name(repo), {})
+            for pull in pulls:
+                updated_at = pull["updated_at"]
+                reviewers = _first_times(
+                    (login, at or updated_at)
+                    for login, at, _ in pull["reviews"])
+                commentators = _first_times(
+                    comment for _, _, comments in pull["reviews"]
+                    for comment in comments)
+                for login, at in reviewers.items():
+                    count(repo_users, login, at, "reviews")
+                for login, at in commentators.items():
+                    count(repo_users, login, at, "comments")
+                if pull["merged_by"]:
+                    count(repo_users, pull["merged_by"], pull["merged_at"],
+                          "merges")
+        return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    _REPO_RE = re.compile(
+        r"^/repos/([^/]+)/([^/]+)(?:/pulls(?:/(\d+)(/reviews|/comments)?)?)?$")
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def _fake(self):
+        return self.server.fake
+
+    def _url(self, path):
+        return self._fake.base_url + path
+
+    def _user(self, login):
+        return {"login": login, "id": sum(map(ord, login)), "type": "User",
+                "url": self._url("/users/" + login)}
+
+    def _repo(self, name):
+        data = self._fake.data
+        return {"name": name, "full_name": data.full_name(name),
+                "id": sorted(data.repos).index(name) + 1,
+                "url": self._url("/repos/" + data.full_name(name)),
+                "owner": self._user(data.org)}
+
+    def _pull(self, repo, pull, full=False):
+        result = {
+            "number": pull["number"], "id": pull["number"], "state": "closed",
+            "url": self._url("/repos/{}/pulls/{}".format(
+                self._fake.data.full_name(repo), pull["number"])),
+            "title": "Pull request {}".format(pull["number"]),
+            "user": self._user(pull["user"]),
+            "updated_at": pull["updated_at"],
+            "merged_at": pull["merged_at"],
+        }
+        if full:
+            merged_by = pull["merged_by"]
+            result["merged"] = merged_by is not None
+            result["merged_by"] = self._user(merged_by) if merged_by else None
+        return result
+
+    def _admit(self, path, params):
+        "Count the request and send a simulated failure; False when sent."
+        fake = self._fake
+        self._rate_headers, error = fake._admit(path)
+        time.sleep(fake.latency)
+        if error is not None:
+            self._send(*error)
+            return False
+        if fake.on_request is not None:
+            fake.on_request(path, params)
+        return True
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        headers = dict(headers or {})
+        headers.update(getattr(self, "_rate_headers", {}))
+        if status == 200:
+            etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                self._fake._count_not_modified()
+                status, data = 304, b""
+        self.send_response(status)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_page(self, items, path, query):
+        "Send the requested page of items with links to the next ones."
+        per_page = int(query.get("per_page", 30))
+        page = int(query.get("page", 1))
+        last = max(1, (len(items) + per_page - 1) // per_page)
+        links = []
+        if page < last:
+            for rel, number in (("next", page + 1), ("last", last)):
+                params = dict(query, page=number)
+                links.append('<{}?{}>; rel="{}"'.format(
+                    self._url(path), urlencode(sorted(params.items())), rel))
+        headers = {"Link": ", ".join(links)} if links else None
+        self._send(200, items[(page - 1) * per_page:page * per_page], headers)
+
+    def do_GET(self):
+        fake = self._fake
+        url = urlparse(self.path)
+        path = url.path
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        if not self._admit(path, query):
+            return
+        data = fake.data
+        if path == "/user":
+            return self._send(200, self._user("fake"))
+        if path == "/orgs/" + data.org:
+            return self._send(200, {"login": data.org, "id": 1,
+                                    "url": self._url(path)})
+        if path in ("/orgs/{}/repos".format(data.org), "/user/repos"):
+            return self._send_page([self._repo(name) for name in sorted(data.repos)],
+                                   path, query)
+        m = self._REPO_RE.match(path)
+        if m is None or m.group(1) != data.org or m.group(2) not in data.repos:
+            return self._send(404, {"message": "Not Found"})
+        _, repo, number, sub = m.groups()
+        pulls = data.repos[repo]
+        if path.endswith("/pulls"):
+            # pulls are created in the order of their numbers
+            if query.get("sort") == "updated":
+                key = lambda pull: (pull["updated_at"], pull["number"])
+            else:
+                key = lambda pull: pull["number"]
+            pulls = sorted(pulls, key=key,
+                           reverse=query.get("direction", "desc") == "desc")
+            return self._send_page([self._pull(repo, pull) for pull in pulls],
+                                   path, query)
+        if number is None:
+            return self._send(200, self._repo(repo))
+        if not 0 < int(number) <= len(pulls):
+            return self._send(404, {"message": "Not Found"})
+        pull = pulls[int(number) - 1]
+        if sub is None:
+            return self._send(200, self._pull(repo, pull, full=True))
+        if sub == "/reviews":
+            items = [{"id": i + 1, "user": self._user(login),
+                      "state": "COMMENTED", "submitted_at": at}
+                     for i, (login, at, _) in enumerate(pull["reviews"])]
+        else:
+            comments = [comment for _, _, review_comments in pull["reviews"]
+                        for comment in review_comments]
+            items = [{"id": i + 1, "user": self._user(login), "created_at": at}
+                     for i, (login, at) in enumerate(comments)]
+        self._send_page(items, path, query)
+
+    def do_POST(self):
+        fake = self._fake
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self._admit(self.path, body["variables"]):
+            return
+        if self.path != "/graphql":
+            return self._send(404, {"message": "Not Found"})
+        # just the query of githubstats is supported; pages of pulls are
+        # cut like by GitHub, so the truncated ones are fetched by REST
+        variables = body["variables"]
+        # pulls are created in the order of their numbers
+        order = variables["order"]
+        if order["field"] == "UPDATED_AT":
+            key = lambda pull: (pull["updated_at"], pull["number"])
+        else:
+            key = lambda pull: pull["number"]
+        pulls = sorted(fake.data.repos[variables["name"]], key=key,
+                       reverse=order["direction"] == "DESC")
+        start = int(variables["cursor"] or 0)
+        end = min(start + variables["pulls"], len(pulls))
+
+        def actor(login):
+            return {"login": login} if login else None
+
+        def connection(nodes, limit):
+            return {"pageInfo": {"hasNextPage": len(nodes) > limit},
+                    "nodes": nodes[:limit]}
+
+        nodes = []
+        for pull in pulls[start:end]:
+            reviews = [{
+                "author": actor(login),
+                "submittedAt": at,
+                "comments": connection(
+                    [{"author": actor(comment_login), "createdAt": created_at}
+                     for comment_login, created_at in comments],
+                    variables["comments"]),
+            } for login, at, comments in pull["reviews"]]
+            nodes.append({
+                "number": pull["number"],
+                "updatedAt": pull["updated_at"],
+                "author": actor(pull["user"]),
+                "mergedBy": actor(pull["merged_by"]),
+                "mergedAt": pull["merged_at"],
+                "reviews": connection(reviews, variables["reviews"]),
+            })
+        self._send(200, {"data": {"repository": {"pullRequests": {
+            "pageInfo": {"hasNextPage": end < len(pulls), "endCursor": str(end)},
+            "nodes": nodes}}}})
+
+
+class FakeGithub(object):
+    """
+    Fake GitHub API server running in a thread; use it as a context manager.
+
+    Every response is delayed by `latency` seconds, like by the network.
+    With `rate_limit` (limit, window in seconds) responses have rate limit
+    headers and requests over the limit fail till the end of the window.
+    Of other requests, `secondary_p` fail on a secondary rate limit (half
+    of them with Retry-After) and `error_p` on a server error (502).
+
+    `requests` is the number of requests (`not_modified` of the 304
+    responses), `paths` lists paths of the requests; `primary_hits`,
+    `secondary_hits` and `errors` count the failed ones.
+
+    `on_request`, when set, is called as on_request(path, params) before
+    a request is answered; params are the query parameters or variables
+    of the GraphQL query. It can change the data, e.g. to update a pull
+    request during the listing.
+    """
+
+    def __init__(self, data=None, latency=0.0, port=0, rate_limit=None,
+                 secondary_p=0.0, error_p=0.0, seed=0):
+        self.data = data if data is not None else FakeData()
+        self.latency = latency
+        self.secondary_p = secondary_p
+        self.error_p = error_p
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_counters()
+        self.set_rate_limit(rate_limit)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self.base_url = "http://127.0.0.1:{}".format(self._server.server_port)
+        self._thread = None
+        self.on_request = None
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.not_modified = 0
+            self.paths = []
+            self.primary_hits = 0
+            self.secondary_hits = 0
+            self.errors = 0
+
+    def set_rate_limit(self, rate_limit):
+        "Set (limit, window in seconds) of the primary rate limit or None."
+        with self._lock:
+            self.rate_limit = rate_limit
+            if rate_limit is not None:
+                self._remaining = rate_limit[0]
+                self._reset = time.time() + rate_limit[1]
+
+    def _admit(self, path):
+        """
+        Count the request; return its rate limit headers and a simulated
+        failure - (status, body, headers) - or None.
+        """
+        with self._lock:
+            self.requests += 1
+            self.paths.append(path)
+            headers = {}
+            if self.rate_limit is not None:
+                limit, window = self.rate_limit
+                now = time.time()
+                if now >= self._reset:
+                    self._remaining = limit
+                    self._reset = now + window
+                exhausted = self._remaining == 0
+                if exhausted:
+                    self.primary_hits += 1
+                else:
+                    self._remaining -= 1
+                headers = {"X-RateLimit-Limit": str(limit),
+                           "X-RateLimit-Remaining": str(self._remaining),
+                           "X-RateLimit-Reset": str(int(math.ceil(self._reset))),
+                           "X-RateLimit-Resource": "core"}
+                if exhausted:
+                    return headers, (403, {"message": "API rate limit exceeded."}, {})
+            chance = self._random.random()
+            if chance < self.secondary_p:
+                self.secondary_hits += 1
+                retry = {"Retry-After": "1"} if self._random.random() < 0.5 else {}
+                return headers, (403, {"message": "You have exceeded a secondary "
+                                                  "rate limit."}, retry)
+            if chance < self.secondary_p + self.error_p:
+                self.errors += 1
+                return headers, (502, {"message": "Server Error"}, {})
+        return headers, None
+
+    def _count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+### checks ###
+
+def _compare(got, expected, what):
+    "Raise AssertionError describing the first difference of the dicts."
+    if got == expected:
+        return
+    for key in sorted(set(got) | set(expected), key=str):
+        if got.get(key) != expected.get(key):
+            if isinstance(got.get(key), dict) and isinstance(expected.get(key), dict):
+                _compare(got[key], expected[key], "{}[{!r}]".format(what, key))
+            raise AssertionError("{}[{!r}]: {!r} != expected {!r}".format(
+                what, key, got.get(key), expected.get(key)))
+
+def _expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+def _collect(fake, scheduler=None, **kwargs):
+    """
+    Collect statistics of all repositories of the fake; return GithubStats.
+
+    Attributes of the RateLimitScheduler are set by the scheduler dict.
+    Counters of the fake count just requests of the repositories.
+    """
+    gstat = githubstats.GithubStats("token", base_url=fake.base_url, **kwargs)
+    repos = gstat.get_org_repos(fake.data.org)
+    for name, value in (scheduler or {}).items():
+        setattr(gstat.scheduler, name, value)
+    fake.reset_counters()
+    try:
+        gstat.collect_repos([repos[name] for name in sorted(repos)])
+    finally:
+        if gstat.cache is not None:
+            gstat.cache.close()
+    return gstat
+
+def check_workers():
+    """
+    Pull requests fetched by more threads give the same statistics, faster.
+    """
+    data = FakeData(pulls=20)
+    times = {}
+    with FakeGithub(data, latency=0.01) as fake:
+        for workers in (1, 8):
+            start = time.time()
+            gstat = _collect(fake, workers=workers, repo_workers=1)
+            times[workers] = time.time() - start
+            _compare(gstat.stats.to_dict(), data.expected(),
+                     "workers={}".format(workers))
+            print("  {} workers: {} requests, {:.2f}s".format(
+                workers, fake.requests, times[workers]))
+    if times[8] >= times[1]:
+        raise AssertionError("8 workers are not faster than 1")
+
+def check_backends():
+    """
+    GraphQL backend gives the same statistics as REST, by 100x less requests.
+    """
+    data = FakeData(repos=1, pulls=300)
+    page_sizes = githubstats.GRAPHQL_PAGE_SIZES
+    requests = {}
+    with FakeGithub(data) as fake:
+        try:
+            # small pages make pulls with too many reviews or comments,
+            # which are completed by REST
+            for sizes in ({"pulls": 7, "reviews": 2, "comments": 5}, page_sizes):
+                githubstats.GRAPHQL_PAGE_SIZES = sizes
+                results = {}
+                for backend in githubstats._BACKENDS:
+                    gstat = _collect(fake, backend=backend, window="month")
+                    results[backend] = gstat.stats.to_dict()
+                    requests[backend] = fake.requests
+                    print("  {} (pages {pulls}/{reviews}/{comments}): {} requests".format(
+                        backend, fake.requests, **sizes))
+                _compare(results[githubstats.BACKEND_REST], data.expected("month"), "rest")
+                _compare(results[githubstats.BACKEND_GRAPHQL],
+                         results[githubstats.BACKEND_REST], "graphql")
+        finally:
+            githubstats.GRAPHQL_PAGE_SIZES = page_sizes
+    # requests of the last (default) page sizes
+    if requests[githubstats.BACKEND_GRAPHQL] * 100 > requests[githubstats.BACKEND_REST]:
+        raise AssertionError("GraphQL backend does not save two orders of "
+                             "magnitude of requests")
+
+class _FakeRequester(object):
+    "Requester of PyGithub as seen by RateLimitScheduler, with a fixed quota."
+
+    def __init__(self, remaining=-1, limit=-1, reset=0):
+        self.rate_limiting = (remaining, limit)
+        self.rate_limiting_resettime = reset
+
+def _unit(*errors):
+    """
+    Return a unit of work raising the errors one by one, then returning
+    the number of its calls.
+    """
+    calls = []
+    def unit():
+        calls.append(None)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return len(calls)
+    unit.calls = calls
+    return unit
+
+def _timed(scheduler, unit, times=1):
+    "Call the unit by the scheduler; return seconds it took."
+    start = time.time()
+    for _ in range(times):
+        scheduler.call(unit)
+    return time.time() - start
+
+def _move_pull_on_second_page(data, repo, position):
+    """
+    Return on_request hook which updates the pull at the position of
+    the listing by update, when the second page of a listing is requested.
+    The pull moves to the start of the listing, behind the first page.
+    Numbers of the moved pulls are appended to the list `moved` of the hook.
+    """
+    def on_request(path, params):
+        if on_request.moved:
+            return
+        if path.endswith("/pulls"):
+            second_page = params.get("page") == "2"
+        else:
+            second_page = path == "/graphql" and params.get("cursor") is not None
+        if not second_page:
+            return
+        pulls = sorted(data.repos[repo], reverse=True,
+                       key=lambda pull: (pull["updated_at"], pull["number"]))
+        pull = pulls[position]
+        pull["updated_at"] = "2030-01-01T00:00:00Z"
+        on_request.moved.append(pull["number"])
+    on_request.moved = []
+    return on_request
+
+def check_moved_pulls():
+    """
+    Pull request updated during the listing is counted once, not skipped.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for backend in githubstats._BACKENDS:
+            for cached in (False, True):
+                data = FakeData(repos=1, pulls=250)
+                cache_path = os.path.join(tmpdir, backend + ".sqlite")
+                what = backend + (" with the cache" if cached else "")
+                with FakeGithub(data) as fake:
+                    fake.on_request = _move_pull_on_second_page(data, "repo0", -20)
+                    gstat = _collect(fake, backend=backend,
+                                     cache_path=cache_path if cached else None)
+                    _expect(fake.on_request.moved, "no pull moved")
+                    _compare(gstat.stats.to_dict(), data.expected(), what)
+                    print("  {}: pull {} moved, {} requests".format(
+                        what, fake.on_request.moved[0], fake.requests))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def check_scheduler():
+    """
+    RateLimitScheduler waits for the reset, paces, backs off and gives up.
+    """
+    Scheduler = githubstats.RateLimitScheduler
+
+    # just the reserve of the quota is left: wait for the reset, which
+    # is rounded to seconds by GitHub, so one more second
+    requester = _FakeRequester(10, 5000, time.time() + 0.5)
+    elapsed = _timed(Scheduler(requester, reserve=50), _unit())
+    _expect(elapsed >= 1.4, "no wait for the reset: {:.2f}s".format(elapsed))
+
+    # less than 20% of the quota: spread the rest till the reset, here
+    # 10 requests above the reserve in 1s
+    requester = _FakeRequester(60, 1000, time.time() + 1)
+    elapsed = _timed(Scheduler(requester, reserve=50), _unit(), 5)
+    _expect(elapsed >= 0.35, "units are not paced: {:.2f}s".format(elapsed))
+    requester = _FakeRequester(4000, 5000, time.time() + 1)
+    elapsed = _timed(Scheduler(requester, reserve=50), _unit(), 20)
+    _expect(elapsed < 0.1, "units are paced with enough quota: {:.2f}s".format(elapsed))
+
+    # primary rate limit hit: retry after the reset
+    unit = _unit(GithubException(
+        403, {"message": "API rate limit exceeded."},
+        {"x-ratelimit-remaining": "0", "x-ratelimit-reset": str(int(time.time()))}))
+    elapsed = _timed(Scheduler(_FakeRequester()), unit)
+    _expect(len(unit.calls) == 2 and elapsed >= 0.9,
+            "primary limit: {} calls, {:.2f}s".format(len(unit.calls), elapsed))
+
+    # secondary rate limit: retry after Retry-After and slow down
+    scheduler = Scheduler(_FakeRequester())
+    unit = _unit(RateLimitExceededException(
+        403, {"message": "You have exceeded a secondary rate limit."},
+        {"retry-after": "0.3"}))
+    elapsed = _timed(scheduler, unit)
+    _expect(len(unit.calls) == 2 and elapsed >= 0.3,
+            "Retry-After: {} calls, {:.2f}s".format(len(unit.calls), elapsed))
+    _expect(scheduler._interval > 0, "units are not slowed down by Retry-After")
+
+    # server and connection errors: retry after the backoff
+    unit = _unit(GithubException(502, {"message": "Server Error"}, {}),
+                 GithubException(503, {"message": "Unavailable"}, {}),
+                 ConnectionError("connection reset"))
+    elapsed = _timed(Scheduler(_FakeRequester(), backoff=0.1), unit)
+    _expect(len(unit.calls) == 4 and elapsed >= 0.35,
+            "backoff: {} calls, {:.2f}s".format(len(unit.calls), elapsed))
+
+    # too many failures and other errors
+    unit = _unit(*[GithubException(502, {"message": "Server Error"}, {})] * 5)
+    try:
+        Scheduler(_FakeRequester(), max_attempts=3, backoff=0.01).call(unit)
+    except githubstats.UnitFailedError:
+        pass
+    else:
+        raise AssertionError("UnitFailedError not raised")
+    _expect(len(unit.calls) == 3, "failed unit called {}x".format(len(unit.calls)))
+    unit = _unit(GithubException(404, {"message": "Not Found"}, {}))
+    try:
+        Scheduler(_FakeRequester()).call(unit)
+    except githubstats.UnitFailedError:
+        raise AssertionError("404 is retried")
+    except GithubException:
+        pass
+    _expect(len(unit.calls) == 1, "404 called {}x".format(len(unit.calls)))
+
+def check_rate_limits():
+    """
+    Statistics are complete despite rate limits and server errors.
+    """
+    data = FakeData(pulls=30)
+    with FakeGithub(data, latency=0.002, rate_limit=(60, 1.0),
+                    secondary_p=0.03, error_p=0.03) as fake:
+        for backend in githubstats._BACKENDS:
+            start = time.time()
+            gstat = _collect(fake, backend=backend,
+                             scheduler={"backoff": 0.05, "reserve": 10})
+            _compare(gstat.stats.to_dict(), data.expected(), backend)
+            print("  {}: {} requests, {:.1f}s; {} over the limit, {} secondary "
+                  "limits, {} errors".format(
+                      backend, fake.requests, time.time() - start,
+                      fake.primary_hits, fake.secondary_hits, fake.errors))
+
+def check_resume():
+    """
+    Scan interrupted by failures is resumed from the cache, not started over.
+    """
+    data = FakeData(pulls=40)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(tmpdir, "cache.sqlite")
+        with FakeGithub(data, error_p=0.3) as fake:
+            _collect(fake, cache_path=cache_path,
+                     scheduler={"backoff": 0.01, "max_attempts": 3})
+            print("  failing run: {} requests, {} errors".format(
+                fake.requests, fake.errors))
+            fake.error_p = 0.0
+            gstat = _collect(fake, cache_path=cache_path)
+            _compare(gstat.stats.to_dict(), data.expected(), "resumed")
+            resumed = fake.requests
+            _collect(fake)
+            print("  resumed run: {} requests, without the cache {}".format(
+                resumed, fake.requests))
+            _expect(resumed < fake.requests, "the scan started over")
+    finally:
+        shutil.rmtree(tmpdir)
+
+CHECKS = [
+    ("workers", check_workers),
+    ("backends", check_backends),
+    ("moved-pulls", check_moved_pulls),
+    ("scheduler", check_scheduler),
+    ("rate-limits", check_rate_limits),
+    ("resume", check_resume),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check githubstats against a fake GitHub API.")
+    parser.add_argument("checks", nargs="*", metavar="CHECK",
+                        help="checks to run: {} (default: all)".format(
+                            ", ".join(name for name, _ in CHECKS)))
+    parser.add_argument("--serve", action="store_true",
+                        help="just run the fake API till interrupted")
+    parser.add_argument("-p", "--port", type=int, default=0,
+                        help="port of the server (default: any free one)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="show messages of githubstats")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        with FakeGithub(port=args.port) as fake:
+            print("Serving organization {} on {}".format(fake.data.org, fake.base_url))
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+        return 0
+
+    checks = dict(CHECKS)
+    unknown = [name for name in args.checks if name not in checks]
+    if unknown:
+        parser.error("unknown checks: {}".format(", ".join(unknown)))
+    failed = 0
+    for name, check in CHECKS:
+        if args.checks and name not in args.checks:
+            continue
+        print("{}: {}".format(name, check.__doc__.strip()))
+        with open(os.devnull, "w") as devnull:
+            messages = sys.stderr if args.verbose else devnull
+            try:
+                with contextlib.redirect_stderr(messages):
+                    check()
+            except AssertionError as e:
+                print("  FAILED: {}".format(e))
+                failed += 1
+                continue
+        print("  OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
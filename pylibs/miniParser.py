@@ -9,14 +9,141 @@ of the given string. - It's usable for me in some cases but it is far away
 from real parsing.
 """
 
+import os
 import re
+from fnmatch import fnmatchcase
+from array import array
+from bisect import bisect_left, bisect_right
+
+###########################################################
+### support of bytes-like input (bytes, memoryview, mmap)
+###########################################################
+# All functions below accept str as well as bytes-like objects and work
+# on them directly (without decoding or copying), so e.g. a mmap-ed file
+# can be searched. Items of bytes-like objects are ints on Python 3, so
+# sets of chars contain both variants and regexps are compiled twice.
+# The re module of Python 2 cannot search memoryview, so it is copied
+# to str by _searchable() there; use mmap to avoid the copy.
+try:
+    _TEXT_TYPES = (str, unicode)
+except NameError:
+    _TEXT_TYPES = (str,)
+
+def _chars(chars):
+    "Return set of the chars usable for items of str and bytes-like objects"
+    return frozenset(list(chars) + [ord(c) for c in chars])
+
+def _is_text(istr):
+    return isinstance(istr, _TEXT_TYPES)
+
+def _as_input_type(s, istr):
+    "Return the str s encoded to bytes when the istr is bytes-like object."
+    if _is_text(istr) or not _is_text(s):
+        return s
+    return s.encode("utf-8")
+
+def _compile(pattern):
+    "Return pair of compiled regexps - for str and for bytes-like objects"
+    return (re.compile(pattern), re.compile(pattern.encode("ascii")))
+
+if bytes is str:
+    def _searchable(istr):
+        "Return the istr in a form accepted by the re module."
+        if isinstance(istr, memoryview):
+            return istr.tobytes()
+        return istr
+else:
+    def _searchable(istr):
+        "Return the istr in a form accepted by the re module."
+        return istr
+
+def _pick(regexps, istr):
+    return regexps[0] if _is_text(istr) else regexps[1]
+
+def _empty(istr):
+    return "" if _is_text(istr) else b""
+
+_FIND_RE = {}
+
+def _find(istr, sub, start=0, end=None):
+    """
+    Return istr.find(sub, start, end) for str and bytes-like objects.
+
+    The sub is given as str. It is the only way for memoryview, which does not
+    provide the find method.
+    """
+    if end is None:
+        end = len(istr)
+    if _is_text(istr):
+        return istr.find(sub, start, end)
+    if not isinstance(istr, memoryview):
+        return istr.find(sub.encode("ascii"), start, end)
+    if sub not in _FIND_RE:
+        _FIND_RE[sub] = re.compile(re.escape(sub.encode("ascii")))
+    m = _FIND_RE[sub].search(istr, start, end)
+    return m.start() if m else -1
+
+_HASH = _chars("#")
+_BACKSLASH = _chars("\\")
+_STAR = _chars("*")
+_SEMICOLON = _chars(";")
+_QUOTES = _chars("\"'")
+_OPENING_CHARS = _chars("\"'{([")
+_OPENING_BRACKETS = _chars("{([")
+_CLOSING_BRACKETS = _chars("})]")
+_WHITESPACES = _chars("\n\t ")
+_TOKEN_END_CHARS = _chars("\n\t ;})]")
+_SKIPPED_CHARS = _chars(";)]}")
+_COMMENT_STARTS = ("//", "/*", b"//", b"/*")
+_LINE_COMMENT_START = ("//", b"//")
+_BLOCK_COMMENT_START = ("/*", b"/*")
+
+# opening char -> closing char, for str and bytes-like items
+_CLOSING_CHARS = {}
+for _open, _close in zip("{([\"'", "})]\"'"):
+    _CLOSING_CHARS[_open] = _close
+    _CLOSING_CHARS[ord(_open)] = ord(_close)
+
+###########################################################
+### scanning engines
+###########################################################
+# ENGINE_PYTHON walks the string char by char, ENGINE_REGEX skips words,
+# whitespaces and comments by precompiled regexps; results are the same
+ENGINE_PYTHON = "python"
+ENGINE_REGEX = "regex"
+_ENGINES = (ENGINE_PYTHON, ENGINE_REGEX)
+_engine = ENGINE_PYTHON
+
+def set_engine(engine):
+    """
+    Set the default scanning engine; return the previous one.
+
+    :param engine: ENGINE_PYTHON or ENGINE_REGEX
+
+    The engine can be chosen for a single call as well - by the engine
+    parameter of find_next_token(), find_closing_char(), find_key() and
+    find_keys().
+    """
+    global _engine
+    if engine not in _ENGINES:
+        raise ValueError("Unknown engine: %s" % engine)
+    prev = _engine
+    _engine = engine
+    return prev
+
+def _use_regex(engine):
+    if engine is None:
+        engine = _engine
+    elif engine not in _ENGINES:
+        raise ValueError("Unknown engine: %s" % engine)
+    return engine == ENGINE_REGEX
 
 ###########################################################
 ### functions that helps with pseudo parsing of config file
 ###########################################################
 def is_comment_start(istr, index=0):
-    if istr[index] == "#" or (
-            index+1 < len(istr) and istr[index:index+2] in ["//", "/*"]):
+    if istr[index] in _HASH or (
+            index+1 < len(istr) and istr[index:index+2] in _COMMENT_STARTS):
         return True
     return False
 
@@ -33,31 +160,60 @@ def find_end_of_comment(istr, index=0):
 
     In case of block comment, returned index is position of slash after star.
     """
+    istr = _searchable(istr)
     length = len(istr)
 
     if index >= length or index < 0:
         return -1
 
-    if istr[index] == "#" or istr[index:].startswith("//"):
-        return istr.find("\n", index)
+    if istr[index] in _HASH or istr[index:index+2] in _LINE_COMMENT_START:
+        return _find(istr, "\n", index)
 
-    if index+2 < length and istr[index:index+2] == "/*":
-        res = istr.find("*/", index+2)
+    if index+2 < length and istr[index:index+2] in _BLOCK_COMMENT_START:
+        res = _find(istr, "*/", index+2)
         if res != -1:
             return res + 1
 
     return -1
 
 def is_opening_char(c):
-     return c in "\"'{(["
+     return c in _OPENING_CHARS
+
+# quote -> regexp of the closing quote or backslash
+_STRING_END_RE = {}
+for _quote in "\"'":
+    _STRING_END_RE[_quote], _STRING_END_RE[ord(_quote)] = _compile(
+        r"[\\%s]" % _quote)
+
+def _find_end_of_string(istr, index):
+    """
+    Return index of the quote closing the string starting on the index or -1.
+
+    Backslash escapes the next character, like in find_closing_char().
+    """
+    search = _STRING_END_RE[istr[index]].search
+    m = search(istr, index + 1)
+    while m:
+        if istr[m.start()] not in _BACKSLASH:
+            return m.start()
+        m = search(istr, m.start() + 2)
+    return -1
 
-def find_next_token(istr,index=0, end_index=-1):
+def find_next_token(istr,index=0, end_index=-1, table=None, brackets=None,
+                    engine=None):
     """
     Return index of another interesting token or -1 when there is not next.
 
     :param istr: input string
     :param index: begin search from the index; from the start by default
     :param end_index: stop searching at the end_index or end of the string
+    :param table: TokenTable of the istr (see tokenize()); when it is set,
+                  the result is looked up in the table instead of scanning
+                  the string again
+    :param brackets: BracketIndex of the istr (see index_brackets()); used
+                  to skip sections and strings without scanning them
+    :param engine: ENGINE_PYTHON or ENGINE_REGEX; default is set by
+                   set_engine()
 
     In case that initial index contains already some token, skip to another.
     But when searching starts on whitespace or beginning of the comment,
@@ -96,9 +252,19 @@ def find_next_token(istr,index=0, end_index=-1):
     if index >= end_index or index < 0:
         return -1
 
+    if table is not None:
+        res = table.lookup_next_token(index, end_index)
+        if res is not None:
+            return res
+
+    istr = _searchable(istr)
+
+    if _use_regex(engine):
+        return _find_next_token_re(istr, index, end_index, brackets)
+
     #skip to the end of the current token
     if is_opening_char(istr[index]):
-        index2 = find_closing_char(istr, index)
+        index2 = find_closing_char(istr, index, brackets=brackets)
         if index2 == -1:
             return -1
         index = index2 +1;
@@ -107,16 +273,16 @@ def find_next_token(istr,index=0, end_index=-1):
         if index2 == -1:
             return -1
         index = index2 +1
-    elif istr[index] not in "\n\t ;})]":
+    elif istr[index] not in _TOKEN_END_CHARS:
         # so we have to skip to the end of the current token
         index += 1
         while index < end_index:
-            if (istr[index] in "\n\t ;})]"
+            if (istr[index] in _TOKEN_END_CHARS
                     or is_comment_start(istr, index)
                     or is_opening_char(istr[index])):
                 break
             index += 1
-    elif istr[index] in ";)]}":
+    elif istr[index] in _SKIPPED_CHARS:
         index += 1
 
     # find next token (can be already under the current index)
@@ -125,17 +291,52 @@ def find_next_token(istr,index=0, end_index=-1):
             index = find_end_of_comment(istr, index)
             if index == -1:
                 break
-        elif is_opening_char(istr[index]) or istr[index] not in "\t\n ":
+        elif is_opening_char(istr[index]) or istr[index] not in _WHITESPACES:
             return index
         index += 1
     return -1
 
+# whitespaces and terminated comments
+_SPACES_RE = _compile(
+    r"(?:[\n\t ]+|#[^\n]*\n|//[^\n]*\n|/\*[\s\S]*?\*/)*")
+
+def _find_next_token_re(istr, index, end_index, brackets):
+    "find_next_token() of ENGINE_REGEX"
+    c = istr[index]
+    if c in _OPENING_CHARS:
+        index = find_closing_char(istr, index, brackets=brackets,
+                                  engine=ENGINE_REGEX)
+        if index == -1:
+            return -1
+        index += 1
+    elif is_comment_start(istr, index):
+        index = find_end_of_comment(istr, index)
+        if index == -1:
+            return -1
+        index += 1
+    elif c not in _TOKEN_END_CHARS:
+        m = _pick(_WORD_RE, istr).match(istr, index + 1)
+        index = min(m.end() if m else index + 1, end_index)
+    elif c in _SKIPPED_CHARS:
+        index += 1
+
+    index = _pick(_SPACES_RE, istr).match(istr, index).end()
+    # unterminated comment is not skipped by the regexp
+    if index >= end_index or is_comment_start(istr, index):
+        return -1
+    return index
+
 
-def find_closing_char(istr, index=0):
+def find_closing_char(istr, index=0, table=None, brackets=None,
+                      engine=None):
     """
     Returns index of equivalent closing character.
 
     :param istr: input string
+    :param table: TokenTable of the istr (see tokenize())
+    :param brackets: BracketIndex of the istr (see index_brackets())
+    :param engine: ENGINE_PYTHON or ENGINE_REGEX; default is set by
+                   set_engine()
 
     It's similar to the "find" method that returns index of the first character
     of the searched character or -1. But in this function the corresponding
@@ -144,13 +345,7 @@ def find_closing_char(istr, index=0):
         "(hello (world) /* ) */ ), he would say"
     index of the third ")" is returned.
     """
-    important_chars = { #TODO: should be that rather global var?
-        "{" : "}",
-        "(" : ")",
-        "[" : "]",
-        "\"" : "\"",
-        "'" : "'",
-        }
+    important_chars = _CLOSING_CHARS
     length = len(istr)
 
     if length < 2:
@@ -163,73 +358,237 @@ def find_closing_char(istr, index=0):
     if closing_char is None:
         return -1
 
-    isString = istr[index] in "\"'"
+    if table is not None:
+        res = table.lookup_closing_char(index)
+        if res is not None:
+            return res
+
+    if brackets is not None:
+        res = brackets.lookup(index)
+        if res is not None:
+            return res
+
+    istr = _searchable(istr)
+    if istr[index] in _QUOTES:
+        return _find_end_of_string(istr, index)
+
+    if _use_regex(engine):
+        return _find_closing_bracket_re(istr, index, closing_char)
+
+    # closing chars of nested brackets; strings are skipped at once
+    stack = [closing_char]
     index += 1
     curr_c = ""
     while index < length:
         curr_c = istr[index]
-        if curr_c == "\\":
+        if curr_c in _BACKSLASH:
             index += 1
-        elif is_comment_start(istr, index) and not isString:
+        elif is_comment_start(istr, index):
             index = find_end_of_comment(istr, index)
             if index == -1:
                 return -1
-        elif not isString and is_opening_char(curr_c):
-            deep_close = find_closing_char(istr[index:])
-            if deep_close == -1:
-                break
-            index += deep_close
-        elif curr_c == closing_char:
-            return index
+        elif curr_c in _QUOTES:
+            index = _find_end_of_string(istr, index)
+            if index == -1:
+                return -1
+        elif is_opening_char(curr_c):
+            stack.append(important_chars[curr_c])
+        elif curr_c == stack[-1]:
+            stack.pop()
+            if not stack:
+                return index
         index += 1
 
     return -1
 
-def remove_comments(istr):
+def _find_closing_bracket_re(istr, index, closing_char):
+    "find_closing_char() of ENGINE_REGEX for brackets"
+    # only chars matched by the regexp can change the state
+    search = _pick(_BRACKET_SIGNIFICANT_RE, istr).search
+    stack = [closing_char]
+    m = search(istr, index + 1)
+    while m:
+        index = m.start()
+        c = istr[index]
+        if c in _BACKSLASH:
+            index += 1
+        elif is_comment_start(istr, index):
+            index = find_end_of_comment(istr, index)
+            if index == -1:
+                return -1
+        elif c in _QUOTES:
+            index = _find_end_of_string(istr, index)
+            if index == -1:
+                return -1
+        elif c in _OPENING_BRACKETS:
+            stack.append(_CLOSING_CHARS[c])
+        elif c == stack[-1]:
+            stack.pop()
+            if not stack:
+                return index
+        m = search(istr, index + 1)
+    return -1
+
+def remove_comments(istr, engine=None):
     """
     Removes all comments from the given string.
 
     :param istr: input string
+    :param engine: accepted for consistency with other functions; both
+                   engines use the same implementation, which already
+                   skips code and comments by regexps
     :return: return
     """
+    _use_regex(engine)  # unknown engine is still an error
+    return _empty(istr).join(iter_remove_comments([_searchable(istr)]))
 
-    isCommented = False
-    isBlockComment = False
-    str_open = "\"'"
-    ostr = ""
+# states of iter_remove_comments()
+_STATE_CODE = 0
+_STATE_LINE_COMMENT = 1
+_STATE_BLOCK_COMMENT = 2
+_STATE_STRING = 3
+_COMMENT_OR_STRING_RE = _compile(r"[#/\"']")
 
-    length = len(istr)
-    index = 0
+def _read_chunks(fileobj, chunk_size):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
 
-    while index < length:
-        if is_comment_start(istr, index):
-            index = find_end_of_comment(istr,index)
+def _strip_chunk(buf, state, quote, eof):
+    """
+    Remove comments from the buf; part of iter_remove_comments().
+
+    Return tuple (output, state, quote, carry), where carry is a character
+    which cannot be processed without the next chunk ("/", "*", "\\")
+    or None.
+    """
+    out = []
+    carry = None
+    length = len(buf)
+    search_special = _pick(_COMMENT_OR_STRING_RE, buf).search
+    pos = 0
+    while pos < length:
+        if state == _STATE_CODE:
+            m = search_special(buf, pos)
+            if m is None:
+                out.append(buf[pos:])
+                break
+            index = m.start()
+            out.append(buf[pos:index])
+            c = buf[index]
+            pos = index + 1
+            if c in _HASH:
+                state = _STATE_LINE_COMMENT
+            elif c not in _QUOTES:
+                # slash
+                if pos == length:
+                    # "//" or "/*" could be split between chunks
+                    if eof:
+                        out.append(buf[index:pos])
+                    else:
+                        carry = buf[index:pos]
+                elif buf[index:pos+1] in _LINE_COMMENT_START:
+                    state = _STATE_LINE_COMMENT
+                    pos += 1
+                elif buf[index:pos+1] in _BLOCK_COMMENT_START:
+                    state = _STATE_BLOCK_COMMENT
+                    pos += 1
+                else:
+                    out.append(buf[index:pos])
+            else:
+                state = _STATE_STRING
+                quote = c
+                out.append(buf[index:pos])
+        elif state == _STATE_LINE_COMMENT:
+            index = _find(buf, "\n", pos)
             if index == -1:
-                # comment till EOF
                 break
-            if istr[index] == "\n":
-                ostr += "\n"
-        elif istr[index] in str_open:
-            end_str = find_closing_char(istr, index)
-            if end_str == -1:
-                ostr += istr[index:]
+            out.append(buf[index:index+1])
+            state = _STATE_CODE
+            pos = index + 1
+        elif state == _STATE_BLOCK_COMMENT:
+            index = _find(buf, "*/", pos)
+            if index == -1:
+                if not eof and buf[length-1] in _STAR and length - 1 >= pos:
+                    carry = buf[length-1:]
                 break
-            ostr += istr[index:end_str+1]
-            index = end_str
+            state = _STATE_CODE
+            pos = index + 2
         else:
-            ostr += istr[index]
-        index += 1
+            m = _STRING_END_RE[quote].search(buf, pos)
+            if m is None:
+                out.append(buf[pos:])
+                break
+            index = m.start()
+            if buf[index] != quote:
+                # escaped character
+                if index + 1 == length and not eof:
+                    out.append(buf[pos:index])
+                    carry = buf[index:]
+                    break
+                out.append(buf[pos:index+2])
+                pos = index + 2
+            else:
+                out.append(buf[pos:index+1])
+                state = _STATE_CODE
+                pos = index + 1
+    return _empty(buf).join(out), state, quote, carry
 
-    return ostr
+def iter_remove_comments(source, chunk_size=65536):
+    """
+    Removes all comments from the stream; yields comment-free chunks.
+
+    :param source: file object opened for reading or iterable of strings;
+                   binary files and bytes chunks are supported as well
+    :param chunk_size: size of chunks read from the file object
+
+    Streaming variant of remove_comments(); joined output is the same as
+    remove_comments() returns for the whole input. Comments and strings
+    can be split between chunks anyhow, only the state of the scanner and
+    at most one character are kept between chunks, so the memory usage
+    doesn't depend on the size of the input.
+    E.g.:
+        with open("named.conf") as fin, open("named.nocomments", "w") as fout:
+            for chunk in iter_remove_comments(fin):
+                fout.write(chunk)
+    """
+    if hasattr(source, "read"):
+        source = _read_chunks(source, chunk_size)
+    state = _STATE_CODE
+    quote = None
+    carry = None
+    for chunk in source:
+        if not chunk:
+            continue
+        chunk = _searchable(chunk)
+        if carry is not None:
+            chunk = carry + chunk
+        out, state, quote, carry = _strip_chunk(chunk, state, quote, False)
+        if isinstance(carry, memoryview):
+            carry = carry.tobytes()
+        if out:
+            yield out
+    if carry is not None:
+        out = _strip_chunk(carry, state, quote, True)[0]
+        if out:
+            yield out
 
-def find_key(istr, key, index=0, end_index=-1):
+def find_key(istr, key, index=0, end_index=-1, table=None, brackets=None,
+             engine=None):
     """
     Return index of the key or -1.
 
     :param istr: input string; it could be whole file or content of a section
-    :param key: name of the searched key in the current scope
+    :param key: name of the searched key in the current scope; str key is
+                encoded to UTF-8 when istr is bytes-like object
     :param index: start searching from the index
     :param end_index: stop searching at the end_index or end of the string
+    :param table: TokenTable of the istr (see tokenize()); use it when you
+                  look up more keys in the same string
+    :param brackets: BracketIndex of the istr (see index_brackets())
+    :param engine: scanning engine (see set_engine())
 
     Funtion is not recursive. Searched key has to be in the current scope.
     Attention:
@@ -246,6 +605,8 @@ def find_key(istr, key, index=0, end_index=-1):
     you set end_index higher then length of the string, end_index will be
     automatically corrected to the end of the input string.
     """
+    istr = _searchable(istr)
+    key = _as_input_type(key, istr)
     length = len(istr)
     keylen = len(key)
     notFirstKey = False
@@ -257,17 +618,996 @@ def find_key(istr, key, index=0, end_index=-1):
         return -1
 
     while index != -1:
-        if istr.startswith(key, index):
-            if index+keylen < end_index and istr[index+keylen] in "\n\t {;":
+        if index+keylen >= end_index:
+            # tokens are visited in ascending order, so nothing can be found
+            # behind this point
+            break
+        if istr[index:index+keylen] == key:
+            if istr[index+keylen] in _KEY_END_CHARS:
                 # key has been found
                 return index
 
-        while notFirstKey and index != -1 and istr[index] != ";":
-            index = find_next_token(istr, index)
-        index = find_next_token(istr, index)
+        while notFirstKey and index != -1 and istr[index] not in _SEMICOLON:
+            index = find_next_token(istr, index, table=table,
+                                    brackets=brackets, engine=engine)
+        index = find_next_token(istr, index, table=table, brackets=brackets,
+                                engine=engine)
 
     return -1
 
+_KEY_END_CHARS = _chars("\n\t {;")
+_KEY_WORD_RE = _compile(r"[^\n\t {;]*")
+
+def find_keys(istr, keys, index=0, end_index=-1, all_matches=False,
+              table=None, brackets=None, engine=None):
+    """
+    Return dict with indices of all given keys, found by one walk.
+
+    :param istr: input string; it could be whole file or content of a section
+    :param keys: names of the searched keys in the current scope; str keys
+                 are encoded to UTF-8 when istr is bytes-like object
+    :param index: start searching from the index
+    :param end_index: stop searching at the end_index or end of the string
+    :param all_matches: when True, return list of all indices for every key
+                        instead of the first one
+    :param table: TokenTable of the istr (see tokenize())
+    :param brackets: BracketIndex of the istr (see index_brackets())
+    :param engine: scanning engine (see set_engine())
+
+    It works like calling find_key() for every key, but the tokens of
+    the scope are walked just once. Keys not found have index -1 (or empty
+    list when all_matches is True). Scope and end_index are handled in the
+    same way as in find_key().
+    """
+    istr = _searchable(istr)
+    length = len(istr)
+    keys = set(keys)
+    if all_matches:
+        result = dict((key, []) for key in keys)
+    else:
+        result = dict((key, -1) for key in keys)
+
+    if length < end_index or end_index < 0:
+        end_index = length
+
+    if index >= end_index or index < 0 or not keys:
+        return result
+
+    # searched form of the key -> key
+    keymap = dict((_as_input_type(key, istr), key) for key in keys)
+    # word of the token can be matched by set lookup for keys without
+    # separators; the rest (unusual) is compared with each token
+    words = set(key for key in keymap
+                if key and not any(c in _KEY_END_CHARS for c in key))
+    others = [key for key in keymap if key not in words]
+    minlen = min(len(key) for key in keymap)
+    missing = len(keys)
+    match = _pick(_KEY_WORD_RE, istr).match
+    # memoryview is not hashable
+    as_word = bytes if isinstance(istr, memoryview) else (lambda x: x)
+
+    while index != -1:
+        if index+minlen >= end_index:
+            break
+        found = []
+        word_end = match(istr, index).end()
+        if word_end < end_index:
+            word = as_word(istr[index:word_end])
+            if word in words:
+                found.append(keymap[word])
+        for key in others:
+            keyend = index+len(key)
+            if (keyend < end_index and istr[index:keyend] == key
+                    and istr[keyend] in _KEY_END_CHARS):
+                found.append(keymap[key])
+        for key in found:
+            if all_matches:
+                result[key].append(index)
+            elif result[key] == -1:
+                result[key] = index
+                missing -= 1
+        if not all_matches and missing == 0:
+            break
+        index = find_next_token(istr, index, table=table, brackets=brackets,
+                                engine=engine)
+
+    return result
+
+
+###########################################################
+### bracket index - pairs of opening and closing characters
+###########################################################
+_BRACKET_SIGNIFICANT_RE = _compile(r"[#/\"'{(\[})\]\\]")
+
+
+class BracketIndex(object):
+    """
+    Map of opening characters (brackets, quotes) to their closing characters.
+
+    The index is built by one walk through the string with a stack of opened
+    brackets. Comments, strings and escapes are skipped in the same way as in
+    find_closing_char(), so for every indexed opening character the index
+    contains the same value as find_closing_char() returns (-1 when it is
+    not closed).
+
+    Only opening characters which are real tokens are indexed - e.g. brackets
+    inside comments and strings are not. Use lookup() to get None for them.
+    """
+
+    def __init__(self, istr, pairs=None):
+        self.istr = _searchable(istr)
+        if pairs is None:
+            pairs = self._build()
+        self.pairs = pairs
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def _build(self):
+        istr = self.istr
+        search = _pick(_BRACKET_SIGNIFICANT_RE, istr).search
+        pairs = {}
+        # (index, expected closing char) of opened brackets
+        stack = []
+        m = search(istr)
+        while m:
+            index = m.start()
+            c = istr[index]
+            if c in _BACKSLASH:
+                if stack:
+                    index += 1
+            elif c in _QUOTES:
+                close = _find_end_of_string(istr, index)
+                pairs[index] = close
+                if close == -1:
+                    break
+                index = close
+            elif is_comment_start(istr, index):
+                index = find_end_of_comment(istr, index)
+                if index == -1:
+                    break
+            elif c in _OPENING_BRACKETS:
+                pairs[index] = -1
+                stack.append((index, _CLOSING_CHARS[c]))
+            elif stack and stack[-1][1] == c:
+                pairs[stack.pop()[0]] = index
+            m = search(istr, index + 1)
+        return pairs
+
+    def lookup(self, index):
+        """
+        Return index of the closing char or None when the index is unknown.
+        """
+        return self.pairs.get(index, None)
+
+
+def index_brackets(istr):
+    """
+    Return BracketIndex of the given string.
+
+    Pass it to find_closing_char(), find_next_token() or find_key() when
+    they are called repeatedly on the same string.
+    """
+    return BracketIndex(istr)
+
+
+###########################################################
+### token table - walk the input just once, query it many times
+###########################################################
+TOKEN_WORD = 0
+TOKEN_STRING = 1
+TOKEN_COMMENT = 2
+TOKEN_OPEN = 3
+TOKEN_CLOSE = 4
+TOKEN_SEMICOLON = 5
+
+# words are split by the same characters as in find_next_token(); inside
+# brackets a backslash escapes the next character like in find_closing_char()
+_WORD_RE = _compile(r"(?:[^\n\t ;})\]\"'{(\[#/]|/(?![/*]))+")
+_ESC_WORD_RE = _compile(
+    r"(?:\\[\s\S]?|[^\\\n\t ;})\]\"'{(\[#/]|/(?![/*]))+")
+
+
+class TokenTable(object):
+    """
+    Table of all tokens of the string, created by one walk through it.
+
+    Each token is described by its offset, end offset (exclusive), kind
+    (TOKEN_* constants) and nesting depth (number of brackets around).
+    Opening brackets and strings know the offset of their closing character
+    (or -1), so whole sections can be skipped without scanning them.
+    Whitespaces are not tokens.
+
+    The table is used by find_next_token(), find_closing_char() and
+    find_key() when passed as the table parameter; these functions return
+    the same indices as without the table. Only positions that the table
+    cannot answer (e.g. index inside a comment or string) are still scanned.
+
+    Attention: the table describes the string it has been created from,
+    do not use it for another (or modified) string. Use edit() to modify
+    the string together with the table.
+    """
+
+    def __init__(self, istr):
+        self._reset(istr)
+        self._lex()
+        # _skips[i] - number of comments to skip to get the first
+        # non-comment token since the i-th one
+        self._skips = array("l", [0]) * (len(self.starts) + 1)
+        self._update_skips(0, len(self.starts))
+
+    def _reset(self, istr, base=0):
+        self.istr = _searchable(istr)
+        self.starts = array("l")
+        # lengths of tokens, not end offsets, so they stay valid when offsets
+        # are shifted by edit()
+        self._lens = array("l")
+        self.kinds = array("b")
+        self.depths = array("l")
+        # distance to the paired char (see pair()) - the closing char for
+        # TOKEN_OPEN, TOKEN_STRING, the opening bracket for TOKEN_CLOSE;
+        # 0 when there is not any; relative values stay valid when offsets
+        # are shifted by edit()
+        self._dists = array("l")
+        # backslashes inside brackets; find_closing_char() skips the next
+        # char after them, but find_next_token() takes them as part of a word
+        self.escapes = array("l")
+        # number of the first token; used for partial tables (see edit())
+        self._base = base
+        # token number -> closing offset of brackets opened before the first
+        # token of the partial table
+        self._outer_closes = {}
+
+    def pair(self, i):
+        """
+        Return offset of the char paired with the i-th token or -1.
+
+        It is the closing char for opening brackets and strings (the same
+        as find_closing_char() returns) and the opening bracket for closing
+        brackets.
+        """
+        dist = self._dists[i]
+        return self.starts[i] + dist if dist else -1
+
+    def end(self, i):
+        "Return end offset (exclusive) of the i-th token."
+        return self.starts[i] + self._lens[i]
+
+    def _next_solid(self, i):
+        "Return number of the first non-comment token since the i-th one."
+        return i + self._skips[i]
+
+    def _update_skips(self, lo, hi):
+        "Update _skips of tokens lo..hi-1 and of comments before them."
+        nxt = self._next_solid(hi)
+        i = hi - 1
+        while i >= lo or (i >= 0 and self.kinds[i] == TOKEN_COMMENT):
+            if self.kinds[i] != TOKEN_COMMENT:
+                nxt = i
+            self._skips[i] = nxt - i
+            i -= 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def bracket_index(self):
+        "Return BracketIndex of the string, created without scanning it."
+        pairs = {}
+        for i in range(len(self.starts)):
+            if self.kinds[i] in (TOKEN_OPEN, TOKEN_STRING):
+                pairs[self.starts[i]] = self.pair(i)
+        return BracketIndex(self.istr, pairs)
+
+    def __getitem__(self, i):
+        "Return (start, end, kind, depth) of the i-th token."
+        return (self.starts[i], self.end(i), self.kinds[i], self.depths[i])
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self[i]
+
+    def _add(self, start, end, kind, depth, close=-1):
+        self.starts.append(start)
+        self._lens.append(end - start)
+        self.kinds.append(kind)
+        self.depths.append(depth)
+        self._dists.append(close - start if close != -1 else 0)
+
+    def _set_close(self, num, index):
+        if num >= self._base:
+            num -= self._base
+            self._dists[num] = index - self.starts[num] if index != -1 else 0
+        else:
+            self._outer_closes[num] = index
+
+    def _lex(self, index=0, stack=None, sync=None):
+        """
+        Append tokens of the string since the index to the table.
+
+        :param stack: list of (token number, offset, expected closing char)
+                      of brackets opened before the index
+        :param sync: function(index, stack) called before each token; lexing
+                     stops when it returns True
+        Return the index where lexing stopped.
+        """
+        istr = self.istr
+        length = len(istr)
+        if stack is None:
+            stack = []
+        match_word = _pick(_WORD_RE, istr).match
+        match_esc_word = _pick(_ESC_WORD_RE, istr).match
+        while index < length:
+            c = istr[index]
+            if c in _WHITESPACES:
+                index += 1
+                continue
+            if sync is not None and sync(index, stack):
+                return index
+            if is_comment_start(istr, index):
+                end = find_end_of_comment(istr, index)
+                end = length if end == -1 else end + 1
+                self._add(index, end, TOKEN_COMMENT, len(stack))
+                index = end
+            elif c in _QUOTES:
+                close = _find_end_of_string(istr, index)
+                end = length if close == -1 else close + 1
+                self._add(index, end, TOKEN_STRING, len(stack), close)
+                index = end
+            elif c in _OPENING_BRACKETS:
+                stack.append((self._base + len(self.starts), index,
+                              _CLOSING_CHARS[c]))
+                self._add(index, index + 1, TOKEN_OPEN, len(stack) - 1)
+                index += 1
+            elif c in _CLOSING_BRACKETS:
+                opening = -1
+                if stack and stack[-1][2] == c:
+                    num, opening = stack.pop()[:2]
+                    self._set_close(num, index)
+                self._add(index, index + 1, TOKEN_CLOSE, len(stack), opening)
+                index += 1
+            elif c in _SEMICOLON:
+                self._add(index, index + 1, TOKEN_SEMICOLON, len(stack))
+                index += 1
+            else:
+                if stack:
+                    end = match_esc_word(istr, index).end()
+                    esc = _find(istr, "\\", index, end)
+                    while esc != -1:
+                        self.escapes.append(esc)
+                        esc = _find(istr, "\\", esc + 2, end)
+                else:
+                    end = match_word(istr, index).end()
+                self._add(index, end, TOKEN_WORD, len(stack))
+                index = end
+        return index
+
+    def _token_at(self, index):
+        "Return number of the token starting on the index or None."
+        i = bisect_right(self.starts, index) - 1
+        if i >= 0 and self.starts[i] == index:
+            return i
+        return None
+
+    def _is_gap(self, index):
+        "Return True when the index is on whitespace between tokens."
+        i = bisect_right(self.starts, index) - 1
+        return (i < 0 or self.end(i) <= index) and index < len(self.istr)
+
+    def _has_escape(self, begin, end):
+        "Return True when an escape is placed between begin and end (incl.)."
+        i = bisect_left(self.escapes, begin)
+        return i < len(self.escapes) and self.escapes[i] <= end
+
+    def lookup_next_token(self, index, end_index):
+        """
+        Return the result of find_next_token() or None when unknown.
+
+        None is returned when the index is not start of a token nor
+        a whitespace between tokens, or when the result could be affected
+        by an escape (see self.escapes). In such a case the string has
+        to be scanned.
+        """
+        i = self._token_at(index)
+        if i is not None:
+            if self.kinds[i] == TOKEN_OPEN:
+                if not self._dists[i]:
+                    return -1
+                pos = self.pair(i) + 1
+                scan_from = pos
+            else:
+                pos = self.end(i)
+                scan_from = index
+        elif self._is_gap(index):
+            pos = scan_from = index
+        else:
+            return None
+
+        n = self._next_solid(bisect_left(self.starts, pos))
+        if n < len(self.starts) and self.starts[n] < end_index:
+            res = self.starts[n]
+        else:
+            res = -1
+        if self._has_escape(scan_from, len(self.istr) if res == -1 else res):
+            return None
+        return res
+
+    def lookup_closing_char(self, index):
+        """
+        Return the result of find_closing_char() or None when unknown.
+        """
+        i = self._token_at(index)
+        if i is None or self.kinds[i] not in (TOKEN_OPEN, TOKEN_STRING):
+            return None
+        return self.pair(i)
+
+    def _depth_before(self, i):
+        "Return number of brackets opened before the i-th token."
+        if i < len(self.starts):
+            if self.kinds[i] == TOKEN_CLOSE and self._dists[i]:
+                return self.depths[i] + 1
+            return self.depths[i]
+        if not self.starts:
+            return 0
+        if self.kinds[i-1] == TOKEN_OPEN:
+            return self.depths[i-1] + 1
+        return self.depths[i-1]
+
+    def _stack_before(self, i):
+        """
+        Return stack of brackets opened before the i-th token (see _lex()).
+
+        Closed sections are skipped at once, so only tokens of the enclosing
+        sections are visited.
+        """
+        stack = []
+        depth = self._depth_before(i)
+        i -= 1
+        while len(stack) < depth:
+            if self.kinds[i] == TOKEN_OPEN:
+                stack.append((i, self.starts[i],
+                              _CLOSING_CHARS[self.istr[self.starts[i]]]))
+            elif self.kinds[i] == TOKEN_CLOSE and self._dists[i]:
+                i = self._token_at(self.pair(i))
+            i -= 1
+        stack.reverse()
+        return stack
+
+    def edit(self, start, end, replacement):
+        """
+        Replace istr[start:end] by the replacement and update the table.
+
+        Only the affected region is tokenized again: lexing restarts on the
+        token before the edit and stops as soon as it reaches a token which
+        has been in the table already with the same opened brackets. Offsets
+        of following tokens are just shifted.
+        Edits which change pairing of brackets (e.g. insertion of a single
+        opening bracket) change all following tokens, so the rest of the
+        string is tokenized again.
+        """
+        istr = self.istr
+        if not 0 <= start <= end <= len(istr):
+            raise ValueError("Invalid range of the edit: %d:%d" % (start, end))
+        new_istr = istr[:start] + replacement + istr[end:]
+        delta = len(replacement) - (end - start)
+        rep_end = start + len(replacement)
+
+        # the token ending at e is decided by chars up to e+1, so tokens
+        # ending before start-1 cannot be affected
+        first = bisect_right(self.starts, start - 2) - 1
+        if first < 0 or self.end(first) <= start - 2:
+            first += 1
+        if first < len(self.starts) and self.starts[first] < start:
+            lex_from = self.starts[first]
+        else:
+            lex_from = start
+        stack = self._stack_before(first)
+        synced = [len(self.starts)]
+
+        def sync(index, stack):
+            # the rest of the string is the same as before the edit; when
+            # the same brackets are opened, the same tokens are found
+            if index < rep_end:
+                return False
+            old_index = index - delta
+            k = self._token_at(old_index)
+            if k is None or self._depth_before(k) != len(stack):
+                return False
+            for num, offset, _ in stack:
+                if num >= first:
+                    if start <= offset < rep_end:
+                        return False
+                    if offset >= rep_end:
+                        offset -= delta
+                    num = self._token_at(offset)
+                    if num is None or self.kinds[num] != TOKEN_OPEN:
+                        return False
+                if -1 < self.pair(num) < old_index:
+                    return False
+            synced[0] = k
+            return True
+
+        part = TokenTable.__new__(TokenTable)
+        part._reset(new_istr, first)
+        part._lex(lex_from, stack, sync)
+        k = synced[0]
+
+        count = len(part.starts)
+        moved = first + count - k
+        # brackets still opened have the same closing chars as before;
+        # (closing token number, offset of the opening bracket) to update
+        spanning = []
+        for num, offset, _ in stack:
+            if k == len(self.starts):
+                close = -1
+            else:
+                if num >= first:
+                    num_old = self._token_at(offset if offset < start
+                                             else offset - delta)
+                else:
+                    num_old = num
+                close = self.pair(num_old)
+                if close != -1:
+                    spanning.append((self._token_at(close) + moved, offset))
+                    close += delta
+            part._set_close(num, close)
+
+        if k < len(self.starts):
+            old_sync_index = self.starts[k]
+        else:
+            old_sync_index = len(istr)
+        # only offsets behind the edit are shifted, other arrays keep relative
+        # values; map() of a builtin function keeps it out of the interpreter
+        # loop
+        self.istr = new_istr
+        if delta:
+            self.starts[first:] = part.starts + array(
+                "l", map(delta.__add__, self.starts[k:]))
+        else:
+            self.starts[first:k] = part.starts
+        self._lens[first:k] = part._lens
+        self.kinds[first:k] = part.kinds
+        self.depths[first:k] = part.depths
+        self._dists[first:k] = part._dists
+        for num, close in part._outer_closes.items():
+            self._dists[num] = close - self.starts[num] if close != -1 else 0
+        for num, opening in spanning:
+            self._dists[num] = opening - self.starts[num]
+        i = bisect_left(self.escapes, lex_from)
+        self.escapes[i:] = part.escapes + array("l", map(delta.__add__,
+            self.escapes[bisect_left(self.escapes, old_sync_index):]))
+        self._skips[first:k] = array("l", [0]) * count
+        self._update_skips(first, first + count)
+
+
+def tokenize(istr):
+    """
+    Return TokenTable of the given string.
+
+    Create it once and pass it to find_next_token(), find_closing_char()
+    or find_key() when you need to search in the same string repeatedly.
+    """
+    return TokenTable(istr)
+
+
+class Document(object):
+    """
+    Editable text with its token table kept up to date.
+
+    Edits are given as (start, end, replacement) - like replacing of
+    text[start:end] - and only the affected region is tokenized again
+    (see TokenTable.edit()). All queries use the token table, so they do
+    not scan the whole text after each edit.
+    The text has to be str or bytes, mmap and memoryview cannot be edited.
+    E.g.
+        doc = Document(text)
+        index = doc.find_key("options")
+        doc.edit(index, index+len("options"), "opts")
+    """
+
+    def __init__(self, text):
+        self.table = tokenize(text)
+
+    @property
+    def text(self):
+        return self.table.istr
+
+    def edit(self, start, end, replacement):
+        "Replace text[start:end] by the replacement."
+        self.table.edit(start, end, replacement)
+
+    def insert(self, index, text):
+        self.table.edit(index, index, text)
+
+    def delete(self, start, end):
+        self.table.edit(start, end, self.text[start:start])
+
+    def find_next_token(self, index=0, end_index=-1):
+        return find_next_token(self.text, index, end_index, table=self.table)
+
+    def find_closing_char(self, index=0):
+        return find_closing_char(self.text, index, table=self.table)
+
+    def find_key(self, key, index=0, end_index=-1):
+        return find_key(self.text, key, index, end_index, table=self.table)
+
+    def find_keys(self, keys, index=0, end_index=-1, all_matches=False):
+        return find_keys(self.text, keys, index, end_index, all_matches,
+                         table=self.table)
+
+    def bracket_index(self):
+        return self.table.bracket_index()
+
+    def parse_tree(self):
+        return parse_tree(self.text, self.table)
+
+
+###########################################################
+### section tree - parse once, query by paths
+###########################################################
+class Node(object):
+    """
+    Statement of the config file, e.g. 'zone "example.com" IN { ... };'
+
+    :ivar key: first token of the statement ("zone"); None for the root
+               node and for sections without any key
+    :ivar values: other words and strings of the statement in the original
+                  form - strings keep their quotes
+    :ivar children: list of statements inside the section(s) of the statement
+                    or None when the statement has no section
+    :ivar start: offset of the first token of the statement
+    :ivar end: offset behind the last character of the statement (behind
+               the semicolon when it is present)
+    :ivar body_start, body_end: offsets of brackets of the (last) section
+                                or -1
+    """
+
+    def __init__(self, key, start, end=-1):
+        self.key = key
+        self.values = []
+        self.children = None
+        self.start = start
+        self.end = end
+        self.body_start = -1
+        self.body_end = -1
+
+    def __repr__(self):
+        return "<Node %s %r [%d:%d]>" % (self.key, self.values,
+                                         self.start, self.end)
+
+    @property
+    def value(self):
+        "Return the first value without quotes or None."
+        if not self.values:
+            return None
+        val = self.values[0]
+        if len(val) > 1 and val[0] in _QUOTES and val[-1] == val[0]:
+            return val[1:-1]
+        return val
+
+    def iter_descendants(self):
+        "Yield all nodes inside the node (depth-first, in the file order)."
+        stack = [iter(self.children or ())]
+        while stack:
+            for child in stack[-1]:
+                yield child
+                if child.children:
+                    stack.append(iter(child.children))
+                break
+            else:
+                stack.pop()
+
+    def get_all(self, path):
+        """
+        Return list of all nodes matching the path.
+
+        :param path: keys separated by dots (e.g. "options.listen-on") or
+                     list of keys - use it when a key contains dot itself.
+                     Keys can contain wildcards ("*", "?", "[seq]") and
+                     "**" matches any number of levels (including none).
+                     Str keys are encoded to UTF-8 when the tree has been
+                     parsed from bytes-like object.
+        """
+        if isinstance(path, (list, tuple)):
+            parts = path
+        else:
+            parts = path.split(".")
+        nodes = [self]
+        for part in parts:
+            found = []
+            if part == "**":
+                for node in nodes:
+                    found.append(node)
+                    found.extend(node.iter_descendants())
+            else:
+                is_pattern = any(c in part for c in "*?[")
+                for node in nodes:
+                    for child in node.children or ():
+                        if child.key is None:
+                            continue
+                        key_part = _as_input_type(part, child.key)
+                        if child.key == key_part or (is_pattern and
+                                fnmatchcase(child.key, key_part)):
+                            found.append(child)
+            if len(nodes) > 1 and part == "**":
+                # nested nodes could be found more times
+                seen = set()
+                unique = []
+                for node in found:
+                    if id(node) not in seen:
+                        seen.add(id(node))
+                        unique.append(node)
+                found = unique
+            nodes = found
+        return nodes
+
+    def get(self, path, default=None):
+        "Return the first node matching the path (see get_all()) or default."
+        nodes = self.get_all(path)
+        return nodes[0] if nodes else default
+
+
+def parse_tree(istr, table=None):
+    """
+    Parse the string into tree of Node objects and return the root node.
+
+    :param istr: input string
+    :param table: TokenTable of the istr; created when it is not set
+
+    Statements are separated by semicolons; any statement can contain
+    sections in brackets with nested statements. Comments are ignored.
+    E.g.
+        tree = parse_tree(cc)
+        tree.get("controls.a-tak-dale.kdyby.nahodou").value   # "prselo}"
+    """
+    istr = _searchable(istr)
+    if table is None:
+        table = tokenize(istr)
+    # keys and values are bytes for bytes-like input
+    text = bytes if isinstance(istr, memoryview) else (lambda x: x)
+    root = Node(None, 0, len(istr))
+    root.children = []
+    # (node, offset of its closing bracket) of opened sections
+    stack = [(root, -2)]
+    current = None
+    for i in range(len(table)):
+        start, end, kind, depth = table[i]
+        if kind == TOKEN_COMMENT:
+            continue
+        if kind in (TOKEN_WORD, TOKEN_STRING):
+            if current is None:
+                current = Node(text(istr[start:end]), start)
+                stack[-1][0].children.append(current)
+            else:
+                current.values.append(text(istr[start:end]))
+            current.end = end
+        elif kind == TOKEN_OPEN:
+            if current is None:
+                current = Node(None, start)
+                stack[-1][0].children.append(current)
+            if current.children is None:
+                current.children = []
+            current.body_start = start
+            stack.append((current, table.pair(i)))
+            current = None
+        elif kind == TOKEN_CLOSE:
+            if start != stack[-1][1]:
+                # stray closing character
+                continue
+            current = stack.pop()[0]
+            current.body_end = start
+            current.end = end
+        elif current is not None:
+            current.end = end
+            current = None
+    return root
+
+
+_tree_cache = {}
+
+def load_tree(path):
+    """
+    Return the root Node of the parsed file; use cached tree when possible.
+
+    Parsed trees are cached per file and parsed again only when mtime or size
+    of the file has been changed, so repeated queries on unchanged files are
+    cheap. Do not modify returned trees, they are shared.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    cached = _tree_cache.get(path, None)
+    if cached is not None and cached[0] == (st.st_mtime, st.st_size):
+        return cached[1]
+    with open(path) as fp:
+        tree = parse_tree(fp.read())
+    _tree_cache[path] = ((st.st_mtime, st.st_size), tree)
+    return tree
+
+def clear_tree_cache():
+    "Drop all trees cached by load_tree()."
+    _tree_cache.clear()
+
+
+###########################################################
+### include trees - configs split into more files
+###########################################################
+def _load_file(path):
+    "Return (stamp, tree) of the file; used by workers of load_includes()."
+    st = os.stat(path)
+    with open(path) as fp:
+        tree = parse_tree(fp.read())
+    return (st.st_mtime, st.st_size), tree
+
+def _cached_tree(path):
+    "Return tree of the file from the cache of load_tree() or None."
+    cached = _tree_cache.get(path, None)
+    if cached is None:
+        return None
+    st = os.stat(path)
+    if cached[0] != (st.st_mtime, st.st_size):
+        return None
+    return cached[1]
+
+def _include_paths(tree):
+    "Return list of paths of all include statements in the tree (any depth)."
+    return [node.value for node in tree.iter_descendants()
+            if node.key == "include" and node.values]
+
+
+class IncludeTree(object):
+    """
+    Config file together with all files included into it.
+
+    :ivar path: absolute path of the main file
+    :ivar base_dir: absolute directory relative includes are resolved against
+    :ivar files: dict absolute path -> root Node of the file
+    :ivar includes: dict absolute path -> list of absolute paths of files
+                    included by the file (in the file order)
+    :ivar root: merged tree - include statements are replaced by statements
+                of included files, so it can be queried as one file;
+                offsets of nodes point into the file they come from
+    """
+
+    def __init__(self, path, files, includes, base_dir=None):
+        self.path = path
+        if base_dir is None:
+            base_dir = os.path.dirname(path)
+        self.base_dir = base_dir
+        self.files = files
+        self.includes = includes
+        self.root = self._merge(files[path], path)
+
+    def _merge(self, node, path):
+        "Return copy of the node with expanded includes (node when none)."
+        if not node.children:
+            return node
+        children = []
+        changed = False
+        for child in node.children:
+            if child.key == "include" and child.values:
+                inc = _resolve_include(self.base_dir, child.value)
+                children.extend(self._merge(self.files[inc], inc).children)
+                changed = True
+                continue
+            merged = self._merge(child, path)
+            changed = changed or merged is not child
+            children.append(merged)
+        if not changed:
+            return node
+        # cached trees are shared, do not modify them
+        copy = Node(node.key, node.start, node.end)
+        copy.values = node.values
+        copy.children = children
+        copy.body_start = node.body_start
+        copy.body_end = node.body_end
+        return copy
+
+    def get_all(self, path):
+        "Return list of all nodes matching the path (see Node.get_all())."
+        return self.root.get_all(path)
+
+    def get(self, path, default=None):
+        "Return the first node matching the path (see Node.get())."
+        return self.root.get(path, default)
+
+
+def _resolve_include(base_dir, inc):
+    return os.path.normpath(os.path.join(base_dir, inc))
+
+def _check_include_cycles(path, includes):
+    "Raise ValueError when a file includes itself (directly or indirectly)."
+    done = set()
+    # (path, iterator of its includes) of the current chain
+    chain = [(path, iter(includes[path]))]
+    in_chain = set([path])
+    while chain:
+        for inc in chain[-1][1]:
+            if inc in in_chain:
+                names = [item[0] for item in chain]
+                names = names[names.index(inc):] + [inc]
+                raise ValueError("Include cycle: %s" % " -> ".join(names))
+            if inc not in done:
+                chain.append((inc, iter(includes[inc])))
+                in_chain.add(inc)
+            break
+        else:
+            done.add(chain[-1][0])
+            in_chain.discard(chain.pop()[0])
+
+def load_includes(path, processes=None, base_dir=None):
+    """
+    Load the config file with all included files and return IncludeTree.
+
+    :param path: path of the main config file
+    :param processes: number of worker processes; files are parsed
+                      in the current process when it is 1, default is
+                      number of CPUs
+    :param base_dir: directory relative paths of include statements are
+                     resolved against (the working directory of the server),
+                     default is the directory of the main file
+
+    Files are discovered level by level - all files included by already
+    loaded files are parsed in parallel in a process pool. Relative paths
+    of include statements in all files are resolved against the same base
+    directory, like the server does it. Parsed files are cached like by
+    load_tree(), so only changed files are parsed again next time.
+    Raises ValueError when an included file does not exist or when files
+    include each other in a cycle.
+    """
+    path = os.path.abspath(path)
+    if base_dir is None:
+        base_dir = os.path.dirname(path)
+    base_dir = os.path.abspath(base_dir)
+    if processes is None:
+        try:
+            processes = os.cpu_count() or 1
+        except AttributeError:
+            import multiprocessing
+            processes = multiprocessing.cpu_count()
+    files = {}
+    includes = {}
+    pool = None
+    pending = [path]
+    seen = set(pending)
+    try:
+        while pending:
+            todo = []
+            for fpath in pending:
+                tree = _cached_tree(fpath)
+                if tree is None:
+                    todo.append(fpath)
+                else:
+                    files[fpath] = tree
+            if len(todo) > 1 and processes > 1:
+                if pool is None:
+                    import multiprocessing
+                    pool = multiprocessing.Pool(processes)
+                results = pool.map(_load_file, todo)
+            else:
+                results = [_load_file(fpath) for fpath in todo]
+            for fpath, (stamp, tree) in zip(todo, results):
+                _tree_cache[fpath] = (stamp, tree)
+                files[fpath] = tree
+
+            new = []
+            for fpath in pending:
+                incs = [_resolve_include(base_dir, inc)
+                        for inc in _include_paths(files[fpath])]
+                includes[fpath] = incs
+                for inc in incs:
+                    if inc not in seen:
+                        if not os.path.isfile(inc):
+                            raise ValueError("File %s included by %s does "
+                                             "not exist" % (inc, fpath))
+                        seen.add(inc)
+                        new.append(inc)
+            pending = new
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    _check_include_cycles(path, includes)
+    return IncludeTree(path, files, includes, base_dir)
+
 
 #######################################################
 if __name__ == "__main__":
@@ -329,3 +1669,74 @@ controls {
     print (index, cc[index:])
 
 
+    print "=================================="
+    # fixed results of the original implementation (before the engines
+    # and the token table), so both engines cannot be wrong the same way
+    expected_removed = [
+        ('a /* b */ c', 'a  c'),
+        ('x // y\nz', 'x \nz'),
+        ('a "/* not */" b', 'a "/* not */" b'),
+        ('# c\nk v;', '\nk v;'),
+        ('a /* unclosed', 'a '),
+        ('k "\\"/*"; // x', 'k "\\"/*"; '),
+    ]
+    expected_tokens = [100, 108, 193, 195, 204, 298, 316, 325, 347, -1]
+    expected_aa_tokens = [22, 6, 32, 16, 22, 29, 32]
+    expected_closing = [(108, 192), (120, -1), (186, -1), (200, -1)]
+    expected_keys = [("options", 0, -1, 100), ("controls", 0, -1, 195),
+                     ("controls", 200, -1, 316), ("valid", 0, -1, -1),
+                     ("fake", 0, -1, -1), ("nahodou", 0, 150, -1)]
+    for engine in _ENGINES:
+        for text, removed in expected_removed:
+            assert remove_comments(text, engine=engine) == removed
+        tokens = []
+        index = 0
+        while index < ccl and index != -1:
+            index = find_next_token(cc, index, engine=engine)
+            tokens.append(index)
+        assert tokens == expected_tokens
+        assert ([find_next_token(aa, i, engine=engine)
+                 for i in range(0, len(aa), 5)] == expected_aa_tokens)
+        for i, closing in expected_closing:
+            assert find_closing_char(cc, i, engine=engine) == closing
+        for key, i, end_i, found in expected_keys:
+            assert find_key(cc, key, i, end_i, engine=engine) == found
+
+    # both engines have to return the same results for all examples above,
+    # for str as well as bytes-like input
+    import mmap
+    import tempfile
+
+    def inputs(text):
+        data = text.encode("ascii")
+        yield text
+        yield memoryview(data)
+        with tempfile.TemporaryFile() as fmap:
+            fmap.write(data)
+            fmap.flush()
+            mapped = mmap.mmap(fmap.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    for text in [aa, cc] + [aa[i:] for i in range(len(aa))]:
+        table = tokenize(text)
+        for itext in inputs(text):
+            for engine in _ENGINES:
+                assert (remove_comments(itext, engine=engine)
+                        == _as_input_type(remove_comments(text), itext))
+                for i in range(len(text)):
+                    for end_i in (-1, len(text) // 2):
+                        assert (find_next_token(itext, i, end_i,
+                                                engine=engine)
+                                == find_next_token(text, i, end_i))
+                    assert (find_closing_char(itext, i, engine=engine)
+                            == find_closing_char(text, i))
+                for key in ("options", "controls", "valid", "fake"):
+                    assert (find_key(itext, key, engine=engine)
+                            == find_key(text, key))
+            itable = tokenize(itext)
+            assert (list(zip(itable.starts, itable.kinds, itable.depths))
+                    == list(zip(table.starts, table.kinds, table.depths)))
+    print "engines are equivalent"
@@ -0,0 +1,273 @@
+#!/usr/bin/python
+
+"""
+Benchmarks of miniParser on synthetic named.conf-like configs.
+
+Every measured dimension (size, nesting depth, comment density, string
+density) is changed separately while others keep their default values, so
+the results show how the functions scale. Results are printed as a table
+and can be saved as JSON and compared with results of another revision:
+
+    ./miniParserBench.py -o new.json --compare old.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import miniParser
+
+DEFAULTS = {
+    "size": 256 * 1024,
+    "depth": 3,
+    "comments": 0.1,
+    "strings": 0.3,
+}
+
+DIMENSIONS = {
+    "size": [64 * 1024, 256 * 1024, 1024 * 1024],
+    "depth": [1, 3, 6, 10],
+    "comments": [0.0, 0.1, 0.3, 0.6],
+    "strings": [0.0, 0.3, 0.6, 0.9],
+}
+
+_KEYS = ["options", "zone", "acl", "view", "controls", "logging", "key",
+         "server", "masters", "allow-query", "allow-transfer", "file", "type",
+         "directory", "forwarders", "listen-on", "channel", "category"]
+
+
+def generate_config(size, depth=3, comments=0.1, strings=0.3, seed=0):
+    """
+    Return synthetic named.conf-like config of (roughly) the given size.
+
+    :param size: length of the result in characters
+    :param depth: maximal nesting of sections
+    :param comments: probability that a statement is preceded by a comment
+    :param strings: probability that a value is a quoted string
+
+    Comments of all supported kinds (#, //, /* */) are used; strings and
+    comments contain brackets and semicolons sometimes, so they have to be
+    skipped properly. The same arguments give always the same config.
+    """
+    rand = random.Random(seed)
+    out = []
+    length = 0
+
+    def comment(indent):
+        kind = rand.randint(0, 2)
+        text = "note %d { ; }" % rand.randint(0, 1000)
+        if kind == 0:
+            return "%s# %s\n" % (indent, text)
+        if kind == 1:
+            return "%s// %s\n" % (indent, text)
+        return "%s/* %s\n%s   more */\n" % (indent, text, indent)
+
+    def value():
+        if rand.random() < strings:
+            return '"v%d.example.com; {x}"' % rand.randint(0, 100000)
+        return "v%d" % rand.randint(0, 100000)
+
+    def statement(level):
+        indent = "    " * level
+        parts = []
+        if rand.random() < comments:
+            parts.append(comment(indent))
+        key = rand.choice(_KEYS)
+        if level < depth and rand.random() < 0.5:
+            parts.append("%s%s %s {\n" % (indent, key, value()))
+            for _ in range(rand.randint(1, 4)):
+                parts.append(statement(level + 1))
+            parts.append("%s};\n" % indent)
+        else:
+            values = " ".join(value() for _ in range(rand.randint(1, 3)))
+            parts.append("%s%s %s;\n" % (indent, key, values))
+        return "".join(parts)
+
+    while length < size:
+        stmt = statement(0)
+        out.append(stmt)
+        length += len(stmt)
+    return "".join(out)[:size]
+
+
+def _walk(istr, engine):
+    "Visit all tokens of all sections by find_next_token()."
+    count = 0
+    # (index, end_index) of sections to walk
+    todo = [(0, len(istr))]
+    while todo:
+        index, end_index = todo.pop()
+        if index < end_index and istr[index] in " \t\n":
+            index = miniParser.find_next_token(istr, index, end_index,
+                                               engine=engine)
+        while index != -1:
+            count += 1
+            if istr[index] == "{":
+                close = miniParser.find_closing_char(istr, index,
+                                                     engine=engine)
+                if close != -1:
+                    todo.append((index + 1, close))
+            index = miniParser.find_next_token(istr, index, end_index,
+                                               engine=engine)
+    return count
+
+def _closing_chars(istr, engine):
+    "Find closing brackets of all top-level sections."
+    index = 0
+    while index != -1:
+        if istr[index] == "{":
+            miniParser.find_closing_char(istr, index, engine=engine)
+        index = miniParser.find_next_token(istr, index, engine=engine)
+
+def _find_keys(istr, engine):
+    "Look up every key (the missing one walks the whole top level)."
+    for key in _KEYS + ["missing-key"]:
+        miniParser.find_key(istr, key, engine=engine)
+
+BENCHMARKS = [
+    ("remove_comments",
+     lambda istr, engine: miniParser.remove_comments(istr, engine=engine)),
+    ("find_next_token", _walk),
+    ("find_closing_char", _closing_chars),
+    ("find_key", _find_keys),
+]
+
+
+def _timeit(func, repeat):
+    "Return the best time of the repeated calls."
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(dimensions=None, engines=None, repeat=3, seed=0, log=None):
+    """
+    Run benchmarks and return list of results (dicts).
+
+    :param dimensions: dict dimension -> list of values; DIMENSIONS by
+                       default
+    :param engines: list of engines (see miniParser.set_engine())
+    :param log: file object for progress messages
+    """
+    if dimensions is None:
+        dimensions = DIMENSIONS
+    if engines is None:
+        engines = [miniParser.ENGINE_PYTHON, miniParser.ENGINE_REGEX]
+    results = []
+    for dim in sorted(dimensions):
+        for val in dimensions[dim]:
+            params = dict(DEFAULTS)
+            params[dim] = val
+            istr = generate_config(seed=seed, **params)
+            for name, func in BENCHMARKS:
+                for engine in engines:
+                    secs = _timeit(lambda: func(istr, engine), repeat)
+                    res = {
+                        "dimension": dim,
+                        "value": val,
+                        "function": name,
+                        "engine": engine,
+                        "size": len(istr),
+                        "seconds": secs,
+                        "mb_per_s": (len(istr) / 1e6 / secs if secs
+                                     else None),
+                    }
+                    results.append(res)
+                    if log is not None:
+                        log.write("%-9s %-8s %-18s %-7s %8.4fs\n" % (
+                            dim, val, name, engine, secs))
+    return results
+
+def _revision():
+    "Return git revision of the benchmarked code or None."
+    try:
+        out = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, "w"))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode("ascii").strip()
+
+def _key(res):
+    return (res["dimension"], res["value"], res["function"], res["engine"])
+
+def compare(old, new, out=sys.stdout):
+    "Print ratios of times of matching results (> 1 means slower)."
+    old_results = dict((_key(res), res) for res in old["results"])
+    out.write("%-9s %-8s %-18s %-7s %9s %9s %7s\n" % (
+        "dimension", "value", "function", "engine", "old MB/s", "new MB/s",
+        "ratio"))
+    for res in new["results"]:
+        prev = old_results.get(_key(res), None)
+        if prev is None or not prev["seconds"]:
+            continue
+        out.write("%-9s %-8s %-18s %-7s %9.2f %9.2f %7.2f\n" % (
+            res["dimension"], res["value"], res["function"], res["engine"],
+            prev["mb_per_s"], res["mb_per_s"],
+            res["seconds"] / prev["seconds"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark miniParser on synthetic configs.")
+    parser.add_argument("-o", "--output", help="save results as JSON")
+    parser.add_argument("--compare", metavar="JSON",
+                        help="compare results with previously saved ones")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="number of runs of every benchmark (best "
+                             "is taken)")
+    parser.add_argument("-d", "--dimension", action="append",
+                        choices=sorted(DIMENSIONS),
+                        help="measure only given dimension(s)")
+    parser.add_argument("-e", "--engine", action="append",
+                        choices=miniParser._ENGINES,
+                        help="measure only given engine(s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the config generator")
+    parser.add_argument("--dump", metavar="FILE",
+                        help="just write generated config with default "
+                             "parameters to the file")
+    args = parser.parse_args(argv)
+
+    if args.dump:
+        with open(args.dump, "w") as fp:
+            fp.write(generate_config(seed=args.seed, **DEFAULTS))
+        return 0
+
+    dimensions = DIMENSIONS
+    if args.dimension:
+        dimensions = dict((dim, DIMENSIONS[dim]) for dim in args.dimension)
+    report = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "defaults": DEFAULTS,
+        "results": run(dimensions, args.engine, args.repeat, args.seed,
+                       log=sys.stdout),
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fp:
+            old = json.load(fp)
+        print()
+        compare(old, report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())